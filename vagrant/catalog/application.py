@@ -1,66 +1,430 @@
+import base64
+import datetime
 import json
 import random
-import requests
+import sqlite3
 import string
+import threading
+import time
 
-from database_setup import Base, User, Category, Item
+from collections import defaultdict
+from database_setup import createEngines, adjustItemCounts, bumpVersions, recordChanges
+from database_setup import Base, User, Category, CatalogVersion, Item, ItemChange
 from flask import Flask, render_template, request, redirect, jsonify, url_for, flash, make_response
+from flask import abort
+from flask import Response, stream_with_context
+from flask import json as flask_json
 from flask import session as user_session
-from oauth2client.client import flow_from_clientsecrets, FlowExchangeError
-from sqlalchemy import create_engine, asc
-from sqlalchemy.orm import sessionmaker
+from google_api import GoogleClient
+from jinja2 import FileSystemBytecodeCache
+from oauth2client.client import FlowExchangeError
+from page_cache import PageCache
+from profiling import RequestProfiler
+from search import applyChanges, createSearchIndex, discardChanges
+from sessions import createSessionStore, ServerSideSessionInterface
+from sqlalchemy import and_, asc, event, or_, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, scoped_session, sessionmaker, subqueryload, Session
+from sqlalchemy.orm.exc import NoResultFound
 
 
 # APP SETUP =======================================================================================
 
 app = Flask(__name__)
 
-# Read the OAuth client ID
-client_id = json.loads(open('client_secret.json', 'r').read())['web']['client_id']
 app_name = 'Udacity Project 3'
 
+# Stream catalog.json in chunks instead of building the whole export in memory. Clients can also
+# ask for a streamed export on a per-request basis with /catalog.json?stream=1
+app.config['CATALOG_JSON_STREAM'] = False
+
+# The number of rows fetched from the database cursor at a time while streaming catalog.json
+app.config['CATALOG_JSON_CHUNK_SIZE'] = 1000
+
+# The maximum number of rendered category and item pages kept in memory by each process
+app.config['PAGE_CACHE_SIZE'] = 1024
+
+# The number of items listed per page of a category, on the category page and in its JSON API
+app.config['CATEGORY_PAGE_SIZE'] = 50
+
+# The maximum number of items returned by a search
+app.config['SEARCH_RESULT_LIMIT'] = 50
+
+# The number of rows of a bulk import applied per transaction
+app.config['IMPORT_BATCH_SIZE'] = 500
+
+# The most item changes returned at once, the longest a client may wait for one in seconds, and
+# how often the change log is checked while waiting for changes made by other processes
+app.config['CHANGES_LIMIT'] = 1000
+app.config['CHANGES_MAX_WAIT'] = 30
+app.config['CHANGES_POLL_INTERVAL'] = 1
+
+# Where Google is reached during login, how long to wait for it, and for how many seconds the name
+# and email of a user are kept without asking again
+app.config['GOOGLE_CLIENT_SECRETS'] = 'client_secret.json'
+app.config['GOOGLE_API_URL'] = 'https://www.googleapis.com'
+app.config['GOOGLE_ACCOUNTS_URL'] = 'https://accounts.google.com'
+app.config['GOOGLE_TIMEOUT'] = 5
+app.config['GOOGLE_USER_CACHE_TTL'] = 300
+
+# Record the time every request spends in SQL, templates and sessions, served as histograms per
+# endpoint at /admin/profile.json. A fraction of the requests can also be run under cProfile, with
+# their profiles written to PROFILE_DIRECTORY
+app.config['PROFILE_REQUESTS'] = False
+app.config['PROFILE_SAMPLE_RATE'] = 0
+app.config['PROFILE_DIRECTORY'] = 'profiles'
+
+# Serve the page cache counters at /admin/cache.json and the request profile at
+# /admin/profile.json. They are open to anyone who can reach the app, so they are off unless it is
+# only reachable by its operators
+app.config['ADMIN_ENDPOINTS'] = False
+
+# Where user sessions are kept: 'cookie' keeps them in a signed cookie, while 'memory', 'sqlite'
+# and 'file' keep them on the server and only a short session id in the cookie. SESSION_PATH is the
+# SQLite database or directory to keep them in. Server side sessions last SESSION_TTL seconds after
+# their last change, and expired ones are cleared out every SESSION_CLEANUP_INTERVAL seconds
+app.config['SESSION_BACKEND'] = 'cookie'
+app.config['SESSION_PATH'] = None
+app.config['SESSION_MEMORY_SIZE'] = 10000
+app.config['SESSION_TTL'] = 86400
+app.config['SESSION_CLEANUP_INTERVAL'] = 300
+
+# Keep compiled templates on disk, so a new worker loads them rather than compiling them again.
+# Without a directory they are kept in one under the system temporary directory
+app.config['TEMPLATE_BYTECODE_CACHE'] = True
+app.config['TEMPLATE_CACHE_DIRECTORY'] = None
+
+# Override any of the settings above with those in the file named by CATALOG_SETTINGS, if any
+app.config.from_envvar('CATALOG_SETTINGS', silent=True)
+
+page_cache = PageCache(app.config['PAGE_CACHE_SIZE'])
+
+if app.config['SESSION_BACKEND'] != 'cookie':
+    app.session_interface = ServerSideSessionInterface(
+        createSessionStore(app.config['SESSION_BACKEND'],
+            path = app.config['SESSION_PATH'],
+            max_size = app.config['SESSION_MEMORY_SIZE']
+        ),
+        ttl = app.config['SESSION_TTL'],
+        cleanup_interval = app.config['SESSION_CLEANUP_INTERVAL']
+    )
+
+profiler = RequestProfiler(app,
+    enabled = app.config['PROFILE_REQUESTS'],
+    sample_rate = app.config['PROFILE_SAMPLE_RATE'],
+    directory = app.config['PROFILE_DIRECTORY']
+)
+
+# The client for the Google OAuth endpoints is set up on first use, as it reads the client secrets
+google_client = None
+google_client_lock = threading.Lock()
+
 
 # DATABASE CONNECTION =============================================================================
 
-engine = create_engine('sqlite:///catalog.db')
+# The engines are created on first use, or by createApp, rather than when this module is imported
+engine = None
+writer_engine = None
+engine_lock = threading.Lock()
+
+
+class RoutingSession(Session):
+    """A session which sends every query to the writer engine once it is marked as writing.
+
+    Flushes alone are not sent there, as a transaction split over two SQLite connections would
+    lock itself out, so a request that writes is marked before it runs its first query.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if writer_engine is not engine and self.info.get('writer'):
+            return writer_engine
+
+        return Session.get_bind(self, mapper, clause)
+
+
+# Give each thread, or greenlet when served by gevent, its own session, which acts as a staging
+# environment for any changes to the database. Changes to the session are not committed to the
+# database until database_session.commit(), and the session is removed when the app context of a
+# request ends, so the next request on the thread starts with a new one
+database_session = scoped_session(sessionmaker(class_=RoutingSession))
+
+
+def connectDatabase():
+    """Create the engines and bind the session to them, unless that has been done already."""
+
+    global engine, writer_engine
+
+    with engine_lock:
+        if engine is not None:
+            return
+
+        # Connect to the database given by CATALOG_DATABASE_URL through a pool shared by request
+        # threads. In SQLite performance mode writes go through a separate engine, otherwise both
+        # are the same
+        engine, writer_engine = createEngines()
+
+        # Map the database schema to the metadata of the Base class to use
+        # the database objects as classes when creating new objects
+        Base.metadata.bind = engine
+        database_session.configure(bind=engine)
+
+
+@app.before_request
+def bindDatabaseSession():
+    """Send every query of a request that writes to the database through the writer engine."""
+
+    if engine is None:
+        connectDatabase()
+
+    if request.method != 'POST':
+        return
+
+    # Setting the search index up may create it in a transaction of its own, which must not
+    # happen in the middle of the transaction of a write
+    getSearchIndex()
+
+    # Mark the session rather than binding it anew, as it may have been created already
+    database_session().info['writer'] = True
+
+
+# The search index is set up against the database on first use
+search_index = None
+search_index_lock = threading.Lock()
+
+# Notified whenever changes to items are committed, to wake the clients waiting for them
+changes_condition = threading.Condition()
+
+
+@event.listens_for(database_session, 'after_commit')
+def notifyChanges(session):
+    """Wake the clients waiting for changes to items, if the transaction committed any."""
+
+    if session.info.pop('item_changes', False):
+        with changes_condition:
+            changes_condition.notify_all()
+
+
+@event.listens_for(database_session, 'after_commit')
+def applySearchChanges(session):
+    """Apply the changes made to an in-process search index by a transaction that committed."""
+
+    applyChanges(session)
 
-# Map the database schema to the metadata of the Base class to use
-# the database objects as classes when creating new objects
-Base.metadata.bind = engine
 
-# Initialize a session which acts as a staging environment for any changes to the database.
-# Changes to the session are not committed to the database until database_session.commit()
-database_session = sessionmaker(bind=engine)()
+@event.listens_for(database_session, 'after_rollback')
+def forgetChanges(session):
+    """Forget the changes to items and the search index of a transaction that was rolled back."""
+
+    session.info.pop('item_changes', None)
+    discardChanges(session)
+
+
+@app.teardown_appcontext
+def removeDatabaseSession(exception=None):
+    """Finish the session of the current app context and hand its connection back to the pool."""
+
+    try:
+        # Roll back whatever a failed request left behind, so it cannot leak into the next one
+        if exception is None:
+            database_session.commit()
+        else:
+            database_session.rollback()
+    finally:
+        database_session.remove()
 
 
 # HELPER FUNCTIONS ================================================================================
 
+def supportsUpsert(dialect):
+    """Return whether a database supports insert ... on conflict ... returning."""
+
+    if dialect.name == 'postgresql':
+        return True
+
+    return dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
 def createOrRetrieveUserID(user_session):
-    """Create a new user and add him to the database."""
+    """Return the ID of the user with the email in the session, creating them if they are new."""
 
     name = user_session.get('name')
     email = user_session.get('email')
 
-    # Try and retrieve a user with the given email or else continue to make a new user
+    # Insert the user, or find the existing user with that email, in a single statement. The
+    # update changes nothing, but makes the existing row come back from returning
+    if supportsUpsert(database_session.get_bind().dialect):
+        user_id = database_session.execute(text(
+            'insert into "user" (name, email) values (:name, :email) '
+            'on conflict (email) do update set email = excluded.email returning id'),
+            {'name': name, 'email': email}).scalar()
+        database_session.commit()
+
+        return user_id
+
+    # Otherwise try and retrieve a user with the given email or else make a new user
     try:
-        user = database_session.query(User).filter_by(email=email).one()
-        return user.id
-    except:
+        return database_session.query(User.id).filter_by(email=email).one()[0]
+    except NoResultFound:
         pass
 
-    # Create a new user based on the information passed in from the session information
     user = User(name=name, email=email)
 
-    # Add the new user to the database session and commit the change
-    database_session.add(user)
-    database_session.commit()
-
-    # Retrieve the new user object as we need to return the ID
-    user = database_session.query(User).filter_by(email=email).one()
+    # A concurrent login may have created the user in the meantime, in which case use theirs
+    try:
+        database_session.add(user)
+        database_session.commit()
+    except IntegrityError:
+        database_session.rollback()
+        return database_session.query(User.id).filter_by(email=email).one()[0]
 
     return user.id
 
 
+def getGoogleClient():
+    """Return the client for the Google OAuth endpoints, setting it up on first use."""
+
+    global google_client
+
+    with google_client_lock:
+        if google_client is None:
+            google_client = GoogleClient(app.config['GOOGLE_CLIENT_SECRETS'],
+                api_url = app.config['GOOGLE_API_URL'],
+                accounts_url = app.config['GOOGLE_ACCOUNTS_URL'],
+                timeout = app.config['GOOGLE_TIMEOUT'],
+                user_ttl = app.config['GOOGLE_USER_CACHE_TTL']
+            )
+
+    return google_client
+
+
+def catalogVersion():
+    """Return the current version of the catalog as a whole."""
+
+    return database_session.query(CatalogVersion.version).scalar() or 0
+
+
+def logChanges(changes):
+    """Log changes to items as part of the current write, see recordChanges."""
+
+    recordChanges(database_session, changes)
+    database_session.info['item_changes'] = True
+
+
+def getSearchIndex():
+    """Return the search index, setting it up on first use."""
+
+    global search_index
+
+    with search_index_lock:
+        if search_index is None:
+            search_index = createSearchIndex(engine)
+
+    return search_index
+
+
+def findItems(query):
+    """Return the items best matching a search query, best match first."""
+
+    ids = getSearchIndex().search(database_session, query, app.config['SEARCH_RESULT_LIMIT'])
+
+    if not ids:
+        return []
+
+    # Retrieve the matching items along with their categories in one go, then put them back in
+    # order of relevance
+    items = database_session.query(Item).options(joinedload(Item.category)).filter(
+        Item.id.in_(ids))
+    items_by_id = dict((item.id, item) for item in items)
+
+    return [items_by_id[id] for id in ids if id in items_by_id]
+
+
+def encodeCursor(item):
+    """Return an opaque cursor pointing just past the given item in a category's listing."""
+
+    return base64.urlsafe_b64encode(json.dumps([item.name, item.id]))
+
+
+def decodeCursor(cursor):
+    """Return the (name, id) an opaque cursor points past, or abort if it is not a valid cursor."""
+
+    try:
+        name, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return name, int(id)
+    except (TypeError, ValueError):
+        abort(404)
+
+
+def getItemPage(category, cursor=None):
+    """Return a page of a category's items in (name, id) order, and the cursor of the next page.
+
+    Pages are found by seeking past the last item of the previous page on the index over the
+    category and name, so every page costs the same however deep into the category it is.
+
+    Args:
+      category: the category to list the items of.
+      cursor: the cursor of the page to return, or None for the first page.
+
+    Returns:
+      A tuple of the items on the page and the cursor of the next page, or None if it is the last.
+    """
+
+    page_size = app.config['CATEGORY_PAGE_SIZE']
+
+    query = database_session.query(Item).filter_by(category_id=category.id)
+
+    if cursor is not None:
+        name, id = decodeCursor(cursor)
+
+        # The first condition on its own lets the database seek straight to the page on the index
+        query = query.filter(and_(Item.name >= name, or_(Item.name > name, Item.id > id)))
+
+    # Fetch one more item than fits on the page, to find out whether there is a next page
+    items = query.order_by(Item.name, Item.id).limit(page_size + 1).all()
+
+    if len(items) > page_size:
+        return items[:page_size], encodeCursor(items[page_size - 1])
+
+    return items, None
+
+
+def conditionalResponse(version_tag, render, cache_tags=None):
+    """Respond with a 304 if the client holds the given version of a page, else render the page.
+
+    Args:
+      version_tag: a tag identifying the version of the data the page is built from.
+      render: a function that builds the full response when the client's copy is out of date.
+      cache_tags: if given, keep the rendered page in the page cache under these tags.
+    """
+
+    # Pages render differently for each user, so tie the ETag to whoever is logged in
+    etag = '%s-%s' % (version_tag, user_session.get('user_id', 'anonymous'))
+
+    # Pending flash messages are shown on the next page rendered, so never skip rendering then
+    flashes = '_flashes' in user_session
+
+    if not flashes and etag in request.if_none_match:
+        response = make_response('', 304)
+    elif not flashes and cache_tags is not None:
+        # The ETag carries the version, so pages cached by other processes before a write are
+        # never served once the write is committed
+        key = (request.endpoint, tuple(sorted(request.view_args.items())),
+            request.query_string, etag)
+        page = page_cache.get(key)
+
+        if page is None:
+            page = render()
+            page_cache.set(key, page, cache_tags)
+
+        response = make_response(page)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    response.vary.add('Cookie')
+    return response
+
+
 def getUserByID(user_id):
     """Return a user given their ID."""
 
@@ -77,33 +441,259 @@ def generateResponse(message, code):
     return response
 
 
+def parseTime(value):
+    """Return the UTC time given in ISO 8601 format, such as 2016-04-01T12:30:00, or None."""
+
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+
+    return None
+
+
+def importBatch(rows, first_row, user_id):
+    """Apply a batch of import rows in a single transaction and return the result of each.
+
+    Every row names an item by its category and name, along with an action:
+      create: add the item with the given description.
+      update: change the description, or move the item to new_category or rename it to new_name.
+      delete: remove the item.
+    Items can only be updated and deleted by their owner, the same as through editItem and
+    deleteItem. A row which cannot be applied fails on its own, without failing the rest.
+
+    Args:
+      rows: the rows of the batch, each a dictionary or None if it could not be parsed.
+      first_row: the number of the first row of the batch, to number the results with.
+      user_id: the ID of the user importing the rows, who owns the items they create.
+
+    Returns:
+      A list of dictionaries holding the number, status and, if it failed, error of every row.
+    """
+
+    search_index = getSearchIndex()
+    categories = {}
+    count_deltas = defaultdict(int)
+    evicted_tags = set()
+    changes = []
+    results = []
+
+    def getCategory(name):
+        """Return the category with the given name, or fail the row if there is none."""
+
+        if name not in categories:
+            categories[name] = database_session.query(Category).filter_by(name=name).first()
+
+        if categories[name] is None:
+            raise ValueError('There is no category named %s' % name)
+
+        return categories[name]
+
+    def findItem(category, name):
+        """Return the item with the given name in a category, or None if there is none."""
+
+        return database_session.query(Item).filter_by(category_id=category.id).filter_by(
+            name=name).first()
+
+    try:
+        for number, row in enumerate(rows, first_row):
+            # The cached pages the row affects, evicted only if the row is applied
+            tags = set()
+
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError('The row is not a JSON object')
+
+                category = getCategory(row.get('category'))
+                action = row.get('action')
+
+                if action == 'create':
+                    # Every field is needed, the same as through newItem
+                    if not (row.get('name') and row.get('description')):
+                        raise ValueError('Please ensure all fields have a value')
+
+                    if findItem(category, row['name']) is not None:
+                        raise ValueError('An item with that name already exists in that category')
+
+                    item = Item(name=row['name'], description=row['description'],
+                        category_id=category.id, user_id=user_id)
+                    database_session.add(item)
+                    database_session.flush()
+                    search_index.add(database_session, item)
+
+                    count_deltas[category.id] += 1
+                    tags.add(('category', category.id))
+                elif action in ('update', 'delete'):
+                    item = findItem(category, row.get('name'))
+
+                    if item is None:
+                        raise ValueError('There is no item named %s in that category' % (
+                            row.get('name')))
+
+                    if item.user_id != user_id:
+                        raise ValueError('Item does not belong to you')
+
+                    tags.update([('category', category.id), ('item', category.id, item.name)])
+
+                    if action == 'delete':
+                        search_index.remove(database_session, item)
+                        database_session.delete(item)
+                        database_session.flush()
+
+                        count_deltas[category.id] -= 1
+                    else:
+                        new_category = getCategory(row.get('new_category', category.name))
+                        new_name = row.get('new_name', item.name)
+                        description = row.get('description', item.description)
+
+                        if not (new_name and description):
+                            raise ValueError('Please ensure all fields have a value')
+
+                        if (new_category.id, new_name) != (category.id, item.name) and findItem(
+                                new_category, new_name) is not None:
+                            raise ValueError(
+                                'An item with that name already exists in that category')
+
+                        item.name = new_name
+                        item.description = description
+                        item.category_id = new_category.id
+                        database_session.flush()
+                        search_index.update(database_session, item)
+
+                        count_deltas[category.id] -= 1
+                        count_deltas[new_category.id] += 1
+                        tags.update([('category', new_category.id),
+                            ('item', new_category.id, new_name)])
+                else:
+                    raise ValueError('The action must be create, update or delete')
+            except ValueError as error:
+                # Messages hold the names in the row, which may be any unicode
+                results.append({'row': number, 'status': 'error', 'error': unicode(error)})
+            else:
+                evicted_tags.update(tags)
+                changes.append((action, item))
+                results.append({'row': number, 'status': action + 'd', 'id': item.id})
+
+        # Apply the side effects of the whole batch at once, the same as those of a single write.
+        # An item changed by several rows is logged as the batch left it every time, which mirrors
+        # syncing from the change log end up at all the same. A batch whose every row failed
+        # changed nothing, so it neither bumps versions nor logs changes
+        if changes:
+            bumpVersions(database_session,
+                [tag[1] for tag in evicted_tags if tag[0] == 'category'])
+            adjustItemCounts(database_session, count_deltas)
+            logChanges(changes)
+
+        database_session.commit()
+    # Only a concurrent write can make the batch fail as a whole, which is worth retrying
+    except IntegrityError:
+        database_session.rollback()
+
+        # Keep the errors of rows that failed on their own, and fail every other row with them
+        failed = dict((result['row'], result) for result in results if result['status'] == 'error')
+        results = [failed.get(number) or {'row': number, 'status': 'error',
+            'error': 'A concurrent write conflicted, try again'}
+            for number in xrange(first_row, first_row + len(rows))]
+    else:
+        page_cache.evict(*evicted_tags)
+
+    return results
+
+
+def compactJSON(obj):
+    """Serialize an object without indents or spaces, however jsonify is set to print."""
+
+    return flask_json.dumps(obj, separators=(',', ':'))
+
+
+def generateCatalogJSON():
+    """Generate the catalog.json export in chunks, reading rows from a server-side cursor."""
+
+    chunk_size = app.config['CATALOG_JSON_CHUNK_SIZE']
+
+    # Walk every category joined to its items, in the same order as the buffered export. Rows are
+    # pulled from the cursor a chunk at a time, so only one chunk is ever held in memory
+    rows = database_session.query(Category, Item).outerjoin(Item, Category.items).order_by(
+        Category.id, Item.id).yield_per(chunk_size)
+
+    chunk = ['{"categories":[']
+    category_id = None
+    category_tail = None
+
+    for category, item in rows:
+        # Open a new category element whenever the category changes
+        if category.id != category_id:
+            if category_id is not None:
+                chunk.append(category_tail + ',')
+
+            # Serialize the category with an empty item list and split around it, so the items
+            # can be written between the two halves as they arrive
+            _ = category.serialize
+            _['items'] = []
+            head, tail = compactJSON(_).split('"items":[]', 1)
+
+            chunk.append(head + '"items":[')
+            category_id = category.id
+            category_tail = ']' + tail
+            first_item = True
+
+        # Categories without any items still produce a single row with an empty item
+        if item is not None:
+            if not first_item:
+                chunk.append(',')
+            chunk.append(compactJSON(item.serialize))
+            first_item = False
+
+        # Send what we have so far once the chunk is full
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+
+    if category_id is not None:
+        chunk.append(category_tail)
+
+    chunk.append(']}\n')
+    yield ''.join(chunk)
+
+
 # ROUTE CONFIGURATION =============================================================================
 
 @app.route('/catalog.json')
 def catalogJSON():
     """Return a JSON object describing all categories and their items."""
 
-    # Retrieve all the categories from the database
-    categories = database_session.query(Category).all()
+    def render():
+        # Stream the export if asked to, which keeps memory bounded however big the catalog is
+        if app.config['CATALOG_JSON_STREAM'] or request.args.get('stream'):
+            return Response(stream_with_context(generateCatalogJSON()),
+                mimetype='application/json')
+
+        # Retrieve all the categories along with their items. The items are eager loaded in a
+        # single additional query, so the number of round trips does not grow with the catalog
+        categories = database_session.query(Category).options(
+            subqueryload(Category.items)).order_by(Category.id).all()
 
-    # Create a working array so we can augment the category objects with items
-    categories_collection = []
+        # Create a working array so we can augment the category objects with items
+        categories_collection = []
 
-    for category in categories:
-        # Serialize the given category information into a temporary element
-        _ = category.serialize
+        for category in categories:
+            # Serialize the given category information into a temporary element
+            _ = category.serialize
 
-        # Retrieve all the items that belong to this particular category
-        items = database_session.query(Item).filter_by(category_id=category.id).all()
+            # Serialize all the already loaded items and add them to the temporary element
+            _['items'] = [item.serialize for item in category.items]
 
-        # Serialize all the items and add them to the temporary element
-        _['items'] = [item.serialize for item in items]
+            # Add the temporary element to the working array
+            categories_collection.append(_)
 
-        # Add the temporary element to the working array
-        categories_collection.append(_)
+        # Finally, JSONify the whole working array as the final response. It is always compact,
+        # even where jsonify would pretty print, so it is byte for byte the same as a streamed one
+        return Response(compactJSON({'categories': categories_collection}) + '\n',
+            mimetype='application/json')
 
-    # Finally, JSONify the whole working array as the final response
-    return jsonify(categories=categories_collection)
+    # Skip building the export entirely if the client already holds the current version
+    return conditionalResponse('catalog-%d' % catalogVersion(), render)
 
 
 @app.route('/')
@@ -111,51 +701,264 @@ def catalogJSON():
 def showCategories():
     """The home page. Displays all categories."""
 
-    # Retrieve all the categories from the database
-    categories = database_session.query(Category).order_by(asc(Category.name))
+    def render():
+        # Retrieve all the categories from the database
+        categories = database_session.query(Category).order_by(asc(Category.name))
+
+        # Render the homepage template containing all the categories
+        return render_template('index.html',
+            categories = categories,
+            email = user_session.get('email')
+        )
 
-    # Render the homepage template containing all the categories
-    return render_template('index.html',
-        categories = categories,
-        email = user_session.get('email')
-    )
+    # Skip rendering entirely if the client already holds the current version
+    return conditionalResponse('catalog-%d' % catalogVersion(), render)
 
 
 @app.route('/catalog/<category_name>/')
 def showCategory(category_name):
     """The category page. Displays all the items within that category."""
 
-    # Retrieve all the items for this category from the database
+    # Retrieve the category from the database
     category = database_session.query(Category).filter_by(name=category_name).one()
-    items = database_session.query(Item).filter_by(category_id=category.id).all()
 
-    # Render the category template containing all the items
-    return render_template('category.html',
-        items = items,
-        category_name = category_name,
-        email = user_session.get('email')
-    )
+    # Pages after the first are reached through the cursor of the page before them
+    cursor = request.args.get('after')
+
+    def render():
+        # Retrieve a page of the items for this category from the database
+        items, next_cursor = getItemPage(category, cursor)
+
+        # Render the category template containing the page of items
+        return render_template('category.html',
+            items = items,
+            category_name = category_name,
+            first_page = cursor is None,
+            next_cursor = next_cursor,
+            email = user_session.get('email')
+        )
+
+    # Skip rendering entirely if the client already holds the current version of the category
+    return conditionalResponse('category-%d-%d' % (category.id, category.version), render,
+        cache_tags=[('category', category.id)])
+
+
+@app.route('/catalog/<category_name>.json')
+def categoryJSON(category_name):
+    """Return a JSON object describing a page of the items within a category."""
+
+    # Retrieve the category from the database
+    category = database_session.query(Category).filter_by(name=category_name).one()
+
+    # Pages after the first are reached through the cursor given in the 'next' field of the page
+    # before them
+    cursor = request.args.get('after')
+
+    def render():
+        # Retrieve a page of the items for this category from the database
+        items, next_cursor = getItemPage(category, cursor)
+
+        return jsonify(
+            category = category.serialize,
+            items = [item.serialize for item in items],
+            next = next_cursor
+        )
+
+    # Skip building the page entirely if the client already holds the current version of it
+    return conditionalResponse('category-%d-%d' % (category.id, category.version), render)
 
 
 @app.route('/catalog/<category_name>/<item_name>')
 def showItem(category_name, item_name):
     """The item page. Displays all the information about a particular item."""
 
-    # Retrieve the item from the database
+    # Retrieve the category from the database
     category = database_session.query(Category).filter_by(name=category_name).one()
-    item = database_session.query(Item).filter_by(
-        category_id = category.id).filter_by(name = item_name).one()
 
-    # If this user is the owner, set a flag which we use to alter the template presentation
-    owner = True if user_session.get('user_id') == item.user_id else False
+    def render():
+        # Retrieve the item from the database
+        item = database_session.query(Item).filter_by(
+            category_id = category.id).filter_by(name = item_name).one()
 
-    # Render the item template containing all the item information
-    return render_template('item.html',
-        item = item,
-        category_name = category_name,
-        owner = owner,
-        email = user_session.get('email')
-    )
+        # If this user is the owner, set a flag which we use to alter the template presentation
+        owner = True if user_session.get('user_id') == item.user_id else False
+
+        # Render the item template containing all the item information
+        return render_template('item.html',
+            item = item,
+            category_name = category_name,
+            owner = owner,
+            email = user_session.get('email')
+        )
+
+    # Skip rendering entirely if the client already holds the current version of the category
+    return conditionalResponse('category-%d-%d' % (category.id, category.version), render,
+        cache_tags=[('item', category.id, item_name)])
+
+
+@app.route('/catalog/search')
+def searchItems():
+    """The search page. Displays the items best matching the search query."""
+
+    query = request.args.get('q', '')
+
+    def render():
+        # Render the search template containing the matching items
+        return render_template('search.html',
+            items = findItems(query),
+            query = query,
+            email = user_session.get('email')
+        )
+
+    # Skip searching entirely if the client already holds the results for the current version
+    return conditionalResponse('catalog-%d' % catalogVersion(), render)
+
+
+@app.route('/catalog/search.json')
+def searchItemsJSON():
+    """Return a JSON object describing the items best matching the search query."""
+
+    query = request.args.get('q', '')
+
+    def render():
+        items = []
+
+        for item in findItems(query):
+            # Serialize the item along with the name of its category, to link back to the item
+            _ = item.serialize
+            _['category'] = item.category.name
+            items.append(_)
+
+        return jsonify(items=items)
+
+    # Skip searching entirely if the client already holds the results for the current version
+    return conditionalResponse('catalog-%d' % catalogVersion(), render)
+
+
+@app.route('/catalog/changes')
+def itemChangesJSON():
+    """Return the changes made to items after a sequence number, oldest first.
+
+    Clients mirroring the catalog keep the seq of the last change they applied and pass it back
+    as since, so staying in sync costs as much as the changes made rather than the whole catalog.
+    The query string can hold:
+      since: the seq to return the changes after (default 0, every change).
+      limit: the most changes to return, up to CHANGES_LIMIT.
+      wait: how many seconds to wait for a change if there are none yet, up to CHANGES_MAX_WAIT.
+    The response holds the changes, the seq to pass as since next time, and whether there are
+    more changes to fetch straight away.
+    """
+
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', app.config['CHANGES_LIMIT'])),
+            app.config['CHANGES_LIMIT'])
+        wait = min(float(request.args.get('wait', 0)), app.config['CHANGES_MAX_WAIT'])
+    except ValueError:
+        return generateResponse('Invalid since, limit or wait.', 400)
+
+    if since < 0 or limit < 1:
+        return generateResponse('Invalid since, limit or wait.', 400)
+
+    deadline = time.time() + wait
+    query = database_session.query(ItemChange, Category.name).outerjoin(
+        Category, Category.id == ItemChange.category_id).filter(
+        ItemChange.id > since).order_by(ItemChange.id).limit(limit)
+
+    while True:
+        changes = query.all()
+        remaining = deadline - time.time()
+
+        if changes or remaining <= 0:
+            break
+
+        # Hand the connection back while waiting, so waiting clients do not hold up the pool and
+        # the next query sees the changes committed in the meantime. Changes committed by other
+        # processes are only noticed by polling
+        database_session.close()
+
+        with changes_condition:
+            changes_condition.wait(min(remaining, app.config['CHANGES_POLL_INTERVAL']))
+
+    serialized = []
+
+    for change, category_name in changes:
+        # Serialize the change along with the name of its category, the same as search results
+        _ = change.serialize
+        _['category'] = category_name
+        serialized.append(_)
+
+    return jsonify(changes=serialized, last_seq=changes[-1][0].id if changes else since,
+        more=len(changes) == limit)
+
+
+@app.route('/catalog/export.ndjson')
+def exportItems():
+    """Stream every item, or those of a category or modified since a time, as a line of JSON each.
+
+    The query string can hold a category name, and a UTC time in ISO 8601 format with since.
+    """
+
+    # Only logged in users may export the catalog
+    if 'user_id' not in user_session:
+        return generateResponse('Please log in to export items.', 401)
+
+    query = database_session.query(Item, Category.name).join(Item.category).order_by(Item.id)
+
+    if request.args.get('category') is not None:
+        query = query.filter(Category.name == request.args['category'])
+
+    if request.args.get('since') is not None:
+        since = parseTime(request.args['since'])
+
+        if since is None:
+            return generateResponse('Invalid since time, please use ISO 8601 format.', 400)
+
+        query = query.filter(Item.modified >= since)
+
+    def generate():
+        # Fetch the items a chunk at a time, so exports of any size stream in constant memory
+        for item, category_name in query.yield_per(app.config['CATALOG_JSON_CHUNK_SIZE']):
+            record = item.serialize
+            record['category'] = category_name
+            record['user_id'] = item.user_id
+            record['modified'] = item.modified and item.modified.isoformat()
+
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/catalog/import', methods=['POST'])
+def importItems():
+    """Create, update and delete items given as a line of JSON each, see importBatch.
+
+    The rows are applied in batches of IMPORT_BATCH_SIZE per transaction, and the response holds
+    a line of JSON with the result of each row, in order.
+    """
+
+    # Only logged in users may import items, and they own the items they create
+    if 'user_id' not in user_session:
+        return generateResponse('Please log in to import items.', 401)
+
+    rows = []
+
+    for line in request.get_data().splitlines():
+        if line.strip():
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    results = []
+
+    for start in xrange(0, len(rows), batch_size):
+        results.extend(importBatch(rows[start:start + batch_size], start + 1,
+            user_session['user_id']))
+
+    return Response(''.join(json.dumps(result) + '\n' for result in results),
+        mimetype='application/x-ndjson')
 
 
 @app.route('/catalog/add/', methods=['GET', 'POST'])
@@ -187,12 +990,26 @@ def newItem(category_name=None):
                 user_id = user_session.get('user_id')
             )
 
-            # Add the new item to the database session and commit the change
-            database_session.add(item)
-            database_session.commit()
-
-            # Set an alert to the user that the item was added
-            flash('New item successfully created: %s' % (item.name), 'success')
+            # Add the new item to the database session and commit the change. The item is
+            # flushed first, so it has an id to be added to the search index with
+            try:
+                database_session.add(item)
+                database_session.flush()
+                getSearchIndex().add(database_session, item)
+                bumpVersions(database_session, [category.id])
+                adjustItemCounts(database_session, {category.id: 1})
+                logChanges([('create', item)])
+                database_session.commit()
+            # Item names are unique within a category, so alert the user to pick another name
+            except IntegrityError:
+                database_session.rollback()
+                flash('An item with that name already exists in that category', 'danger')
+            else:
+                # Evict the cached category page that now lists the new item
+                page_cache.evict(('category', category.id))
+
+                # Set an alert to the user that the item was added
+                flash('New item successfully created: %s' % (item.name), 'success')
         # Or else we simply alert the user to try again
         else:
             flash('Please ensure all fields have a value', 'danger')
@@ -246,19 +1063,46 @@ def editItem(category_name, item_name):
 
         # All fields must have a value
         if (post_category and post_name and post_description):
+            # Look the new category up before changing the item, as the query would otherwise
+            # flush the changes outside of the try below
+            new_category_name = post_category
+            new_category = database_session.query(Category).filter_by(name=new_category_name).one()
+
             # Update the item attributes
+            old_category_id = item.category_id
+            old_name = item.name
             item.name = post_name
             item.description = post_description
-            new_category_name = post_category
-            new_category = database_session.query(Category).filter_by(name=new_category_name).one()
             item.category_id = new_category.id
 
-            # Add the update item back into the database
-            database_session.add(item)
-            database_session.commit()
-
-            # Set an alert to the user that the item was edited
-            flash('Item successfully edited', 'success')
+            # Add the update item back into the database and reindex it
+            try:
+                database_session.add(item)
+                database_session.flush()
+                getSearchIndex().update(database_session, item)
+                bumpVersions(database_session, [category.id, new_category.id])
+
+                # Move the item between the counts of the categories, if it changed category
+                if new_category.id != category.id:
+                    adjustItemCounts(database_session, {category.id: -1, new_category.id: 1})
+
+                logChanges([('update', item)])
+                database_session.commit()
+            # Item names are unique within a category, so alert the user to pick another name
+            except IntegrityError:
+                database_session.rollback()
+                flash('An item with that name already exists in that category', 'danger')
+            else:
+                # Evict the cached pages of the item and of the categories it was and is listed in
+                page_cache.evict(
+                    ('category', old_category_id),
+                    ('category', item.category_id),
+                    ('item', old_category_id, old_name),
+                    ('item', item.category_id, item.name)
+                )
+
+                # Set an alert to the user that the item was edited
+                flash('Item successfully edited', 'success')
         # Or else we simply alert the user to try again
         else:
             flash('Please ensure all fields have a value', 'danger')
@@ -301,10 +1145,17 @@ def deleteItem(category_name, item_name):
 
     # If we're in POST, process the form data
     if request.method == 'POST':
-        # Remove the item from the database
+        # Remove the item from the search index and the database
+        getSearchIndex().remove(database_session, item)
         database_session.delete(item)
+        bumpVersions(database_session, [category.id])
+        adjustItemCounts(database_session, {category.id: -1})
+        logChanges([('delete', item)])
         database_session.commit()
 
+        # Evict the cached pages of the item and of the category it was listed in
+        page_cache.evict(('category', category.id), ('item', category.id, item_name))
+
         # Set an alert to the user that the item was deleted
         flash('Item successfully deleted', 'success')
 
@@ -329,7 +1180,7 @@ def showLogin():
 
     # Render the login template and pass in the CSRF token
     return render_template('login.html',
-        client_id = client_id,
+        client_id = getGoogleClient().client_id,
         state = state
     )
 
@@ -344,17 +1195,13 @@ def oauth():
 
     # Upgrade the authorization code into a credentials object or abort on error
     try:
-        oauth_flow = flow_from_clientsecrets('client_secret.json', scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(request.data)
+        credentials = getGoogleClient().exchangeCode(request.data)
     except FlowExchangeError:
         return generateResponse('Failed to upgrade the authorization code.', 401)
 
     # Get the token information from Google
     access_token = credentials.access_token
-    url = 'https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s' % access_token
-    response = requests.get(url)
-    result = response.json()
+    result = getGoogleClient().verifyToken(access_token)
 
     # Abort if there was an error passed back within the access token info
     if result.get('error') is not None:
@@ -366,7 +1213,7 @@ def oauth():
         return generateResponse('User ID for token does not match given user ID.', 401)
 
     # Verify that the access token is valid for this app or abort
-    if result.get('issued_to') != client_id:
+    if result.get('issued_to') != getGoogleClient().client_id:
         return generateResponse('Client ID for token does not match app client ID.', 401)
 
     # Verify that the user is not already connected
@@ -382,9 +1229,7 @@ def oauth():
     user_session['google_id'] = google_id
 
     # Get the user information from Google
-    parameters = {'access_token': access_token, 'alt': 'json'}
-    answer = requests.get('https://www.googleapis.com/oauth2/v1/userinfo', params=parameters)
-    data = answer.json()
+    data = getGoogleClient().getUserInfo(access_token, google_id)
 
     # Store the name and email of the user in their session data
     user_session['name'] = data.get('name')
@@ -414,10 +1259,15 @@ def deauth():
         return redirect(url_for('showCategories'))
 
     # Send the deauthorization request to Google
-    response = requests.get('https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token)
+    status_code = getGoogleClient().revokeToken(access_token)
 
     # If successful (200), delete the user's session information, effectively logging them out
-    if response.status_code == 200:
+    if status_code == 200:
+        # The token is revoked for every session of the user, so end them all with server side
+        # sessions, which unlike cookies can be ended on the server
+        if hasattr(app.session_interface, 'revoke'):
+            app.session_interface.revoke(user_session.get('user_id'))
+
         del user_session['access_token']
         del user_session['email']
         del user_session['google_id']
@@ -440,6 +1290,16 @@ def deauth():
         return redirect(url_for('showCategories'))
 
 
+@app.route('/admin/cache.json')
+def pageCacheJSON():
+    """Return the size and hit, miss and eviction counters of the page cache."""
+
+    if not app.config['ADMIN_ENDPOINTS']:
+        abort(404)
+
+    return jsonify(page_cache.stats())
+
+
 @app.errorhandler(404)
 def pageNotFound(e):
     # Alert the user that the page cannot be found
@@ -458,6 +1318,52 @@ def serverError(e):
     return redirect(url_for('showCategories'))
 
 
+# APP FACTORY =====================================================================================
+
+def warmUp():
+    """Compile every template, set up the search index and open full pools of connections."""
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # Setting the search index up may create it, which would otherwise wait on the writes of the
+    # first requests
+    getSearchIndex()
+
+    # Check out as many connections as each pool keeps open, then hand them all back to it
+    for pool_engine in set([engine, writer_engine]):
+        pool_size = pool_engine.pool.size() if hasattr(pool_engine.pool, 'size') else 1
+        connections = [pool_engine.connect() for i in xrange(pool_size)]
+
+        for connection in connections:
+            connection.close()
+
+
+def createApp(warm=False):
+    """Finish setting the app up and return it, ready to be served.
+
+    Importing this module reads no files and opens no connections, and whatever the app needs is
+    otherwise set up on first use. Serving the app returned by this function instead does all of
+    that up front.
+
+    Args:
+      warm: also compile every template, set up the search index and fill the connection pools,
+        so the first requests a new worker serves do not pay for them.
+    """
+
+    if app.config['TEMPLATE_BYTECODE_CACHE'] and app.jinja_env.bytecode_cache is None:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIRECTORY'])
+
+    connectDatabase()
+    getGoogleClient()
+
+    if warm:
+        warmUp()
+
+    return app
+
+
 if __name__ == '__main__':
     app.secret_key = 'guess_this'
-    app.run(host='0.0.0.0', port=8000)
+    createApp(warm=True).run(host='0.0.0.0', port=8000, threaded=True)
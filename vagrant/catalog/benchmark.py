@@ -0,0 +1,750 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- benchmarks for the catalog app
+#
+# Each benchmark builds its own throwaway database, so they can be run from the catalog directory
+# without touching catalog.db:
+#
+#     $ python benchmark.py lookups
+#
+
+import argparse
+import os
+import random
+import re
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import application
+import requests
+from database_setup import createEngine, createEngines, Base, User, Category, Item
+from google_api import GoogleClient
+from oauth_stub import StubOAuthServer
+from search import createSearchIndex, InvertedIndex
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from timeit import default_timer as timer
+
+
+# HELPER FUNCTIONS ================================================================================
+
+def databaseURL(directory):
+    """Return the URL of the throwaway catalog database in the given directory."""
+
+    return 'sqlite:///%s' % os.path.join(directory, 'catalog.db')
+
+
+def createDatabase(directory, indexes=True):
+    """Create an empty catalog database in the given directory and return its engine."""
+
+    engine = createEngine(databaseURL(directory))
+    Base.metadata.create_all(engine)
+
+    # Drop the secondary indexes to measure what a lookup costs without them
+    if not indexes:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(engine)
+
+    return engine
+
+
+def seedCatalog(engine, categories, items_per_category, users=1, words=None):
+    """Fill a database with a synthetic catalog of the given size.
+
+    If a list of words is given, every item is described by a random sample of them.
+    """
+
+    def describe(i, j):
+        if words is None:
+            return 'Item %d of category %d' % (j, i)
+
+        return ' '.join(random.sample(words, 8))
+
+    connection = engine.connect()
+    transaction = connection.begin()
+
+    connection.execute(User.__table__.insert(), [
+        {'id': i + 1, 'name': 'User %d' % i, 'email': 'user%d@catalog.com' % i}
+        for i in xrange(users)])
+
+    connection.execute(Category.__table__.insert(), [
+        {'id': i + 1, 'name': 'Category %d' % i, 'item_count': items_per_category}
+        for i in xrange(categories)])
+
+    # Insert the items one category at a time to keep memory use flat at large scales
+    for i in xrange(categories):
+        connection.execute(Item.__table__.insert(), [{
+            'name': 'Item %d' % j,
+            'description': describe(i, j),
+            'category_id': i + 1,
+            'user_id': random.randint(1, users)
+        } for j in xrange(items_per_category)])
+
+    transaction.commit()
+    connection.close()
+
+
+def timeCalls(function, arguments):
+    """Call a function once for each of the given arguments and return the mean latency."""
+
+    start = timer()
+
+    for argument in arguments:
+        function(argument)
+
+    return (timer() - start) / len(arguments)
+
+
+def percentile(latencies, fraction):
+    """Return the latency below which the given fraction of the sorted latencies fall."""
+
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def startServer(mode, environment):
+    """Start serve.py in a subprocess and return it with its URL once it accepts connections.
+
+    Returns:
+      A tuple of the process and its URL, or of None and None if it failed to start.
+    """
+
+    # Find a free port by letting the operating system pick one
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, os.path.join(directory, 'serve.py'),
+        '--mode', mode, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=directory, env=environment, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+
+    for i in xrange(100):
+        if process.poll() is not None:
+            return None, None
+
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process, 'http://127.0.0.1:%d' % port
+        except socket.error:
+            time.sleep(0.1)
+
+    process.kill()
+    return None, None
+
+
+def sessionCookie(data):
+    """Return the name and value of the session cookie for a session holding the given data."""
+
+    app = application.app
+
+    with app.test_request_context():
+        session = app.session_interface.open_session(app, application.request)
+        session.update(data)
+        response = app.response_class()
+        app.session_interface.save_session(app, session, response)
+
+    return app.session_cookie_name, response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+
+
+def residentMemory(pid):
+    """Return the current and peak resident memory of a process in megabytes, if it is known."""
+
+    try:
+        with open('/proc/%d/status' % pid) as status:
+            fields = dict(line.split(':', 1) for line in status)
+    except IOError:
+        return '', ''
+
+    return tuple('%.1f' % (int(fields[field].split()[0]) / 1024.0)
+        for field in ('VmRSS', 'VmHWM'))
+
+
+def printRow(*columns):
+    """Print a row of right aligned columns."""
+
+    print ''.join('%20s' % (column,) for column in columns)
+
+
+# BENCHMARKS ======================================================================================
+
+def benchmarkLookups(arguments):
+    """Measure the latency of the name lookups every route makes as the catalog grows."""
+
+    printRow('indexes', 'categories', 'items', 'category us', 'item us', 'user us')
+
+    for indexes in (False, True):
+        for categories in arguments.sizes:
+            directory = tempfile.mkdtemp()
+
+            try:
+                engine = createDatabase(directory, indexes=indexes)
+                seedCatalog(engine, categories, arguments.items, users=categories)
+                session = sessionmaker(bind=engine)()
+
+                # Look up random rows, the same way the routes do
+                names = ['Category %d' % random.randrange(categories)
+                    for i in xrange(arguments.lookups)]
+                keys = [(random.randint(1, categories), 'Item %d' % random.randrange(
+                    arguments.items)) for i in xrange(arguments.lookups)]
+                emails = ['user%d@catalog.com' % random.randrange(categories)
+                    for i in xrange(arguments.lookups)]
+
+                category = timeCalls(
+                    lambda name: session.query(Category).filter_by(name=name).one(), names)
+                item = timeCalls(
+                    lambda key: session.query(Item).filter_by(
+                        category_id=key[0]).filter_by(name=key[1]).one(), keys)
+                user = timeCalls(
+                    lambda email: session.query(User).filter_by(email=email).one(), emails)
+
+                session.close()
+                engine.dispose()
+            finally:
+                shutil.rmtree(directory)
+
+            printRow(indexes, categories, categories * arguments.items,
+                '%.1f' % (category * 1e6), '%.1f' % (item * 1e6), '%.1f' % (user * 1e6))
+
+
+def benchmarkConcurrency(arguments):
+    """Measure read and write throughput under concurrent load, with and without WAL mode."""
+
+    printRow('performance', 'reads/s', 'writes/s', 'busy errors')
+
+    for performance in (False, True):
+        directory = tempfile.mkdtemp()
+
+        try:
+            seedCatalog(createDatabase(directory), arguments.categories, arguments.items)
+            reader, writer = createEngines(databaseURL(directory), performance=performance)
+            counts = {'reads': 0, 'writes': 0, 'errors': 0}
+            lock = threading.Lock()
+            stop = threading.Event()
+
+            def count(key):
+                with lock:
+                    counts[key] += 1
+
+            def read():
+                # Load a category page's worth of data, the same way showCategory does
+                session = sessionmaker(bind=reader)()
+                while not stop.is_set():
+                    try:
+                        category = session.query(Category).filter_by(
+                            name='Category %d' % random.randrange(arguments.categories)).one()
+                        session.query(Item).filter_by(category_id=category.id).all()
+                        session.commit()
+                        count('reads')
+                    except OperationalError:
+                        session.rollback()
+                        count('errors')
+                session.close()
+
+            def write(thread):
+                # Add an item to a random category, the same way newItem does
+                session = sessionmaker(bind=writer)()
+                written = 0
+                while not stop.is_set():
+                    try:
+                        session.add(Item(
+                            name='Item %d-%d' % (thread, written),
+                            description='Written under load',
+                            category_id=random.randint(1, arguments.categories),
+                            user_id=1
+                        ))
+                        session.commit()
+                        written += 1
+                        count('writes')
+                    except OperationalError:
+                        session.rollback()
+                        count('errors')
+                session.close()
+
+            threads = [threading.Thread(target=read) for i in xrange(arguments.readers)]
+            threads += [threading.Thread(target=write, args=(i,))
+                for i in xrange(arguments.writers)]
+
+            for thread in threads:
+                thread.start()
+
+            stop.wait(arguments.duration)
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+            reader.dispose()
+            writer.dispose()
+        finally:
+            shutil.rmtree(directory)
+
+        printRow(performance, '%.0f' % (counts['reads'] / arguments.duration),
+            '%.0f' % (counts['writes'] / arguments.duration), counts['errors'])
+
+
+def benchmarkSearch(arguments):
+    """Measure the latency of ranked prefix searches over a large catalog, per search index."""
+
+    # Describe the items with words from a synthetic vocabulary, and search for prefixes of them
+    vocabulary = [''.join(random.choice(string.ascii_lowercase)
+        for i in xrange(random.randint(4, 10))) for j in xrange(arguments.vocabulary)]
+    queries = [' '.join(random.choice(vocabulary)[:random.randint(3, 5)]
+        for i in xrange(random.randint(1, 2))) for j in xrange(arguments.queries)]
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        engine = createDatabase(directory)
+        start = timer()
+        seedCatalog(engine, arguments.items / 1000 or 1, min(arguments.items, 1000),
+            words=vocabulary)
+        print 'Seeded %d items in %.1f seconds' % (arguments.items, timer() - start)
+
+        printRow('index', 'build s', 'p50 ms', 'p95 ms', 'p99 ms')
+
+        for index_class in (createSearchIndex, InvertedIndex):
+            connection = engine.connect()
+
+            # The in-process index is built on its first search, so time that separately
+            start = timer()
+            search_index = index_class(engine)
+            search_index.search(connection, queries[0], arguments.limit)
+            build = timer() - start
+
+            latencies = []
+
+            for query in queries:
+                start = timer()
+                search_index.search(connection, query, arguments.limit)
+                latencies.append(timer() - start)
+
+            latencies.sort()
+            connection.close()
+
+            printRow(search_index.__class__.__name__, '%.1f' % build,
+                '%.2f' % (percentile(latencies, 0.5) * 1e3),
+                '%.2f' % (percentile(latencies, 0.95) * 1e3),
+                '%.2f' % (percentile(latencies, 0.99) * 1e3))
+
+            del search_index
+
+        engine.dispose()
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmarkLogin(arguments):
+    """Measure the latency of logins against a stub OAuth server, with and without the user cache.
+
+    The stub issues a new access token for every login, the way Google does, so only the user
+    information cached under a Google id can be reused, by users logging in again.
+    """
+
+    directory = tempfile.mkdtemp()
+    stub = StubOAuthServer('benchmark', latency=arguments.latency / 1e3)
+    stub.start()
+
+    try:
+        # Point the app at a throwaway database and at the stub OAuth server
+        engine = createDatabase(directory)
+        application.engine = application.writer_engine = engine
+        application.database_session.configure(bind=engine)
+        application.app.secret_key = 'benchmark'
+        client_secrets = stub.writeClientSecrets(directory)
+
+        printRow('user cache s', 'logins', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms',
+            'requests/login', 'hit rate')
+
+        for user_ttl in (0, 300):
+            application.google_client = GoogleClient(client_secrets,
+                api_url = stub.url,
+                accounts_url = stub.url,
+                user_ttl = user_ttl
+            )
+            google_requests = sum(stub.requests.values())
+            latencies = []
+
+            # Log a random returning user in from a fresh browser each time
+            for i in xrange(arguments.logins):
+                client = application.app.test_client()
+
+                with client.session_transaction() as session:
+                    session['state'] = 'state'
+
+                start = timer()
+                client.post('/oauth?state=state',
+                    data='user%d' % random.randrange(arguments.users))
+                latencies.append(timer() - start)
+
+            latencies.sort()
+
+            cache = application.google_client.cache
+
+            printRow(user_ttl, arguments.logins,
+                '%.2f' % (sum(latencies) / len(latencies) * 1e3),
+                '%.2f' % (percentile(latencies, 0.5) * 1e3),
+                '%.2f' % (percentile(latencies, 0.95) * 1e3),
+                '%.2f' % (percentile(latencies, 0.99) * 1e3),
+                '%.2f' % (float(sum(stub.requests.values()) - google_requests) / arguments.logins),
+                '%.1f%%' % (100.0 * cache.hits / max(cache.hits + cache.misses, 1)))
+
+        engine.dispose()
+    finally:
+        stub.stop()
+        shutil.rmtree(directory)
+
+
+def benchmarkServing(arguments):
+    """Measure the throughput of each serving mode under many concurrent connections."""
+
+    directory = tempfile.mkdtemp()
+    stub = StubOAuthServer('benchmark', latency=arguments.latency / 1e3)
+    stub.start()
+
+    try:
+        seedCatalog(createDatabase(directory), arguments.categories, arguments.items)
+
+        # Send the servers to the stub OAuth server, and verify every login with it so logins
+        # spend most of their time waiting on it
+        settings = os.path.join(directory, 'settings.py')
+
+        with open(settings, 'w') as settings_file:
+            settings_file.write('GOOGLE_CLIENT_SECRETS = %r\n' % stub.writeClientSecrets(
+                directory))
+            settings_file.write('GOOGLE_API_URL = GOOGLE_ACCOUNTS_URL = %r\n' % stub.url)
+            settings_file.write('GOOGLE_USER_CACHE_TTL = 0\n')
+
+        environment = dict(os.environ,
+            CATALOG_DATABASE_URL = databaseURL(directory),
+            CATALOG_SETTINGS = settings
+        )
+
+        printRow('mode', 'connections', 'requests/s', 'p50 ms', 'p99 ms', 'errors')
+
+        for mode in arguments.modes:
+            process, url = startServer(mode, environment)
+
+            if process is None:
+                printRow(mode, arguments.connections, 'unavailable', '', '', '')
+                continue
+
+            latencies = []
+            counts = {'errors': 0}
+            lock = threading.Lock()
+            stop = threading.Event()
+
+            def browse(connection):
+                # Log in, then view category pages, the way a visitor would, over one connection
+                session = requests.Session()
+
+                def timeRequest(method, path, **parameters):
+                    start = timer()
+
+                    try:
+                        response = session.request(method, url + path, timeout=30, **parameters)
+                        response.raise_for_status()
+                    except requests.RequestException:
+                        with lock:
+                            counts['errors'] += 1
+                        return None
+
+                    with lock:
+                        latencies.append(timer() - start)
+
+                    return response
+
+                while not stop.is_set():
+                    page = timeRequest('GET', '/login/')
+
+                    if page is not None:
+                        state = re.search(r'state=(\w+)', page.text).group(1)
+                        timeRequest('POST', '/oauth?state=%s' % state,
+                            data='user%d' % connection)
+
+                    for i in xrange(arguments.pages):
+                        timeRequest('GET', '/catalog/Category %d/' % random.randrange(
+                            arguments.categories))
+
+                    session.cookies.clear()
+
+            threads = [threading.Thread(target=browse, args=(i,))
+                for i in xrange(arguments.connections)]
+
+            for thread in threads:
+                thread.start()
+
+            stop.wait(arguments.duration)
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+            process.terminate()
+            process.wait()
+
+            latencies.sort()
+
+            printRow(mode, arguments.connections, '%.0f' % (len(latencies) / arguments.duration),
+                '%.2f' % (percentile(latencies, 0.5) * 1e3) if latencies else '',
+                '%.2f' % (percentile(latencies, 0.99) * 1e3) if latencies else '',
+                counts['errors'])
+    finally:
+        stub.stop()
+        shutil.rmtree(directory)
+
+
+def driveRoutes(target, send, pid, engine, arguments):
+    """Send every benchmarked route its share of requests and print how each route fared.
+
+    Args:
+      target: the name of what is being driven, to print along with the results.
+      send: a function which sends a request given its method, path and form data, and returns
+        the status code of the response. It is called from several threads at once.
+      pid: the process serving the requests, to measure the memory of.
+      engine: an engine of the database the requests are served from.
+      arguments: the parsed command line arguments.
+    """
+
+    categories = arguments.categories
+
+    def countItems(pattern):
+        return engine.execute(select([func.count()]).where(Item.name.like(pattern))).scalar()
+
+    # Failed writes are answered with a redirect like any other, so count them by what they left
+    # in the database instead
+    failures = {
+        'add': lambda: arguments.requests - countItems('Bench %'),
+        'edit': lambda: arguments.requests - countItems('Bench % edited'),
+        'delete': lambda: countItems('Bench %')
+    }
+
+    engine.execute(Item.__table__.delete().where(Item.name.like('Bench %')))
+
+    # Every route maps a request number to a request. The write routes add items, then edit and
+    # delete the same ones, so each relies on the route before it
+    routes = [
+        ('index', lambda i: ('GET', '/catalog/', None)),
+        ('category', lambda i: ('GET', '/catalog/Category %d/' % random.randrange(categories),
+            None)),
+        ('item', lambda i: ('GET', '/catalog/Category %d/Item %d' % (
+            random.randrange(categories), random.randrange(arguments.items)), None)),
+        ('catalog.json', lambda i: ('GET', '/catalog.json', None)),
+        ('add', lambda i: ('POST', '/catalog/add/', {'category': 'Category %d' % (
+            i % categories), 'name': 'Bench %d' % i, 'description': 'Added under load'})),
+        ('edit', lambda i: ('POST', '/catalog/Category %d/Bench %d/edit/' % (i % categories, i),
+            {'category': 'Category %d' % (i % categories), 'name': 'Bench %d edited' % i,
+                'description': 'Edited under load'})),
+        ('delete', lambda i: ('POST', '/catalog/Category %d/Bench %d edited/delete/' % (
+            i % categories, i), {}))
+    ]
+
+    for name, request in routes:
+        if name not in arguments.routes:
+            continue
+
+        latencies = []
+        counts = {'errors': 0}
+        lock = threading.Lock()
+
+        def work(client):
+            # Every client sends every request whose number falls to it
+            for i in xrange(client, arguments.requests, arguments.clients):
+                method, path, data = request(i)
+                start = timer()
+                status_code = send(method, path, data)
+                latency = timer() - start
+
+                with lock:
+                    latencies.append(latency)
+
+                    if status_code >= 400:
+                        counts['errors'] += 1
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in xrange(arguments.clients)]
+        start = timer()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        duration = timer() - start
+        latencies.sort()
+
+        if name in failures:
+            counts['errors'] = failures[name]()
+
+        printRow(target, name, '%.0f' % (len(latencies) / duration),
+            '%.2f' % (percentile(latencies, 0.5) * 1e3),
+            '%.2f' % (percentile(latencies, 0.95) * 1e3),
+            '%.2f' % (percentile(latencies, 0.99) * 1e3),
+            counts['errors'], *residentMemory(pid))
+
+
+def benchmarkRoutes(arguments):
+    """Measure the throughput, latency and memory use of the main routes, in-process and served."""
+
+    random.seed(arguments.seed)
+    directory = tempfile.mkdtemp()
+
+    try:
+        start = timer()
+        seedCatalog(createDatabase(directory), arguments.categories, arguments.items,
+            users=arguments.users)
+        print 'Seeded %d categories of %d items, owned by %d users, in %.1f seconds' % (
+            arguments.categories, arguments.items, arguments.users, timer() - start)
+
+        # Share the secret key with the served app, so both accept the same session cookie, and
+        # log the writes in as the first user
+        settings = os.path.join(directory, 'settings.py')
+
+        with open(settings, 'w') as settings_file:
+            settings_file.write('SECRET_KEY = %r\n' % 'benchmark')
+
+        application.app.secret_key = 'benchmark'
+        cookie_name, cookie_value = sessionCookie(
+            {'name': 'User 0', 'email': 'user0@catalog.com', 'user_id': 1})
+
+        printRow('target', 'route', 'requests/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors',
+            'rss MB', 'peak rss MB')
+
+        engines = createEngines(databaseURL(directory))
+        engine = engines[0]
+
+        if 'test-client' in arguments.targets:
+            # Point the app at the seeded database, in SQLite performance mode if that is enabled
+            application.engine, application.writer_engine = engines
+            application.database_session.configure(bind=engines[0])
+            application.warmUp()
+            local = threading.local()
+
+            def sendToTestClient(method, path, data):
+                if not hasattr(local, 'client'):
+                    local.client = application.app.test_client()
+                    local.client.set_cookie('localhost', cookie_name, cookie_value)
+
+                return local.client.open(path, method=method, data=data,
+                    buffered=True).status_code
+
+            driveRoutes('test-client', sendToTestClient, os.getpid(), engine, arguments)
+            application.database_session.remove()
+
+            for target_engine in set(engines):
+                target_engine.dispose()
+
+        if 'server' in arguments.targets:
+            process, url = startServer('threaded', dict(os.environ,
+                CATALOG_DATABASE_URL = databaseURL(directory),
+                CATALOG_SETTINGS = settings
+            ))
+
+            if process is None:
+                printRow('server', 'unavailable')
+            else:
+                local = threading.local()
+
+                def sendToServer(method, path, data):
+                    if not hasattr(local, 'session'):
+                        local.session = requests.Session()
+                        local.session.cookies.set(cookie_name, cookie_value)
+
+                    try:
+                        return local.session.request(method, url + path, data=data, timeout=60,
+                            allow_redirects=False).status_code
+                    except requests.RequestException:
+                        return 599
+
+                try:
+                    driveRoutes('server', sendToServer, process.pid, engine, arguments)
+                finally:
+                    process.terminate()
+                    process.wait()
+
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the catalog app.')
+    benchmarks = parser.add_subparsers()
+
+    lookups = benchmarks.add_parser('lookups', help=benchmarkLookups.__doc__)
+    lookups.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+        help='the numbers of categories and users to benchmark with')
+    lookups.add_argument('--items', type=int, default=10, help='the number of items per category')
+    lookups.add_argument('--lookups', type=int, default=1000, help='the number of lookups to time')
+    lookups.set_defaults(benchmark=benchmarkLookups)
+
+    concurrency = benchmarks.add_parser('concurrency', help=benchmarkConcurrency.__doc__)
+    concurrency.add_argument('--categories', type=int, default=100,
+        help='the number of categories to seed')
+    concurrency.add_argument('--items', type=int, default=100,
+        help='the number of items per category to seed')
+    concurrency.add_argument('--readers', type=int, default=8, help='the number of reader threads')
+    concurrency.add_argument('--writers', type=int, default=2, help='the number of writer threads')
+    concurrency.add_argument('--duration', type=float, default=10,
+        help='the number of seconds to run each mode for')
+    concurrency.set_defaults(benchmark=benchmarkConcurrency)
+
+    search = benchmarks.add_parser('search', help=benchmarkSearch.__doc__)
+    search.add_argument('--items', type=int, default=1000000, help='the number of items to seed')
+    search.add_argument('--vocabulary', type=int, default=20000,
+        help='the number of distinct words to describe items with')
+    search.add_argument('--queries', type=int, default=1000, help='the number of searches to time')
+    search.add_argument('--limit', type=int, default=50, help='the number of results per search')
+    search.set_defaults(benchmark=benchmarkSearch)
+
+    login = benchmarks.add_parser('login', help=benchmarkLogin.__doc__)
+    login.add_argument('--logins', type=int, default=1000, help='the number of logins to time')
+    login.add_argument('--users', type=int, default=100, help='the number of distinct users')
+    login.add_argument('--latency', type=float, default=20,
+        help='the milliseconds the stub OAuth server takes to answer each request')
+    login.set_defaults(benchmark=benchmarkLogin)
+
+    serving = benchmarks.add_parser('serving', help=benchmarkServing.__doc__)
+    serving.add_argument('--modes', nargs='+', default=['threaded', 'gevent'],
+        help='the serve.py modes to benchmark')
+    serving.add_argument('--connections', type=int, default=100,
+        help='the number of concurrent connections')
+    serving.add_argument('--duration', type=float, default=10,
+        help='the number of seconds to run each mode for')
+    serving.add_argument('--pages', type=int, default=4,
+        help='the number of category pages viewed per login')
+    serving.add_argument('--latency', type=float, default=50,
+        help='the milliseconds the stub OAuth server takes to answer each request')
+    serving.add_argument('--categories', type=int, default=100,
+        help='the number of categories to seed')
+    serving.add_argument('--items', type=int, default=50,
+        help='the number of items per category to seed')
+    serving.set_defaults(benchmark=benchmarkServing)
+
+    routes = benchmarks.add_parser('routes', help=benchmarkRoutes.__doc__)
+    routes.add_argument('--categories', type=int, default=100,
+        help='the number of categories to seed')
+    routes.add_argument('--items', type=int, default=100,
+        help='the number of items per category to seed')
+    routes.add_argument('--users', type=int, default=10, help='the number of users to seed')
+    routes.add_argument('--requests', type=int, default=1000,
+        help='the number of requests sent to each route')
+    routes.add_argument('--clients', type=int, default=4,
+        help='the number of clients sending requests at once')
+    routes.add_argument('--routes', nargs='+',
+        default=['index', 'category', 'item', 'catalog.json', 'add', 'edit', 'delete'],
+        help='the routes to benchmark')
+    routes.add_argument('--targets', nargs='+', default=['test-client', 'server'],
+        help='drive the app in-process with the Flask test client, or served on a local port')
+    routes.add_argument('--seed', type=int, default=0, help='the seed of the random requests')
+    routes.set_defaults(benchmark=benchmarkRoutes)
+
+    arguments = parser.parse_args()
+    arguments.benchmark(arguments)
@@ -0,0 +1,829 @@
+#!/usr/bin/env python
+#
+# Test cases for application.py
+# These tests run against a throwaway database, so they can be run from the
+# catalog directory without touching catalog.db. To run them against another
+# database, such as a local PostgreSQL one, point CATALOG_TEST_DATABASE_URL at
+# it. Every table in that database is dropped by the tests.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import application
+import loader
+import search
+from database_setup import createEngines, reconcileItemCounts
+from database_setup import Base, User, Category, CatalogVersion, Item
+from google_api import GoogleClient
+from oauth_stub import StubOAuthServer
+from sessions import createSessionStore, ServerSideSessionInterface
+from sqlalchemy import event
+
+
+# TEST DATABASE ===================================================================================
+
+database_file = tempfile.NamedTemporaryFile(suffix='.db')
+
+engine, writer_engine = createEngines(os.environ.get('CATALOG_TEST_DATABASE_URL',
+    'sqlite:///%s' % database_file.name))
+
+# Point the application at the test database instead of catalog.db
+application.engine = engine
+application.writer_engine = writer_engine
+application.database_session.remove()
+application.database_session.configure(bind=engine)
+
+application.app.secret_key = 'test'
+application.app.config['ADMIN_ENDPOINTS'] = True
+
+client = application.app.test_client()
+
+
+def resetDatabase():
+    """Drop and recreate every table so each test starts from an empty catalog."""
+    application.database_session.remove()
+    application.page_cache.clear()
+    application.search_index = None
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    search.createSearchIndex(engine).drop(engine)
+
+
+def addCategories(count, items_per_category, offset=0):
+    """Add a number of categories to the test database, each holding a number of items."""
+    database_session = application.database_session
+
+    user = database_session.query(User).first()
+    if user is None:
+        user = User(name="Test Owner", email="owner@test.com")
+        database_session.add(user)
+
+    for i in xrange(offset, offset + count):
+        category = Category(name="Category %d" % i)
+        database_session.add(category)
+
+        for j in xrange(items_per_category):
+            database_session.add(Item(
+                name="Item %d" % j,
+                description="Item %d of category %d" % (j, i),
+                category=category,
+                user=user
+            ))
+
+    database_session.flush()
+    reconcileItemCounts(database_session)
+    database_session.commit()
+
+
+def logIn(user_id=1):
+    """Log the test client in as the given user."""
+    with client.session_transaction() as session:
+        session['name'] = "Test Owner"
+        session['email'] = "owner@test.com"
+        session['user_id'] = user_id
+
+
+def logOut():
+    """Log the test client out."""
+    with client.session_transaction() as session:
+        session.clear()
+
+
+def countQueries(url):
+    """Request the given URL and return the response along with the number of SQL queries run."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    return response, len(statements)
+
+
+# TESTS ===========================================================================================
+
+def testCatalogJSON():
+    """
+    Test that the JSON export lists every category along with its items.
+    """
+    resetDatabase()
+    addCategories(3, 2)
+    response = client.get('/catalog.json')
+    if response.status_code != 200:
+        raise ValueError("catalog.json should respond with a 200. Got {c}".format(
+            c=response.status_code))
+    categories = json.loads(response.data)['categories']
+    if len(categories) != 3:
+        raise ValueError("catalog.json should list all 3 categories. Got {c}".format(
+            c=len(categories)))
+    for category in categories:
+        if len(category['items']) != 2:
+            raise ValueError("Each category in catalog.json should list its 2 items.")
+    print "1. catalog.json lists every category along with its items."
+
+
+def testCatalogJSONQueryCount():
+    """
+    Test that the JSON export runs a fixed number of queries as the catalog grows.
+    """
+    resetDatabase()
+    addCategories(2, 2)
+    response, small = countQueries('/catalog.json')
+    addCategories(50, 2, offset=2)
+    response, large = countQueries('/catalog.json')
+    if len(json.loads(response.data)['categories']) != 52:
+        raise ValueError("catalog.json should list all 52 categories.")
+    if large != small:
+        raise ValueError(
+            "catalog.json should not run more queries as categories are added. "
+            "Got {s} queries for 2 categories and {l} for 52".format(s=small, l=large))
+    print "2. catalog.json runs {q} queries regardless of the number of categories.".format(
+        q=large)
+
+
+def testCatalogJSONStream():
+    """
+    Test that the streamed JSON export is byte for byte the same as the buffered one.
+    """
+    resetDatabase()
+    streamed = client.get('/catalog.json?stream=1')
+    if streamed.data != client.get('/catalog.json').data:
+        raise ValueError("A streamed empty catalog.json should match a buffered one.")
+    addCategories(5, 3)
+    addCategories(1, 0, offset=5)
+    application.app.config['CATALOG_JSON_CHUNK_SIZE'] = 2
+    try:
+        streamed = client.get('/catalog.json?stream=1')
+    finally:
+        application.app.config['CATALOG_JSON_CHUNK_SIZE'] = 1000
+    buffered = client.get('/catalog.json')
+    if not streamed.is_streamed:
+        raise ValueError("catalog.json?stream=1 should respond with a streamed response.")
+    if streamed.data != buffered.data:
+        raise ValueError("A streamed catalog.json should match the buffered one. Got {s}".format(
+            s=streamed.data))
+    application.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+    try:
+        if client.get('/catalog.json?stream=1').data != client.get('/catalog.json').data:
+            raise ValueError("A streamed catalog.json should match even when pretty printing.")
+    finally:
+        application.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    print "3. A streamed catalog.json matches the buffered catalog.json byte for byte."
+
+
+def testConditionalRequests():
+    """
+    Test that read routes answer 304 until a write changes the data they are built from.
+    """
+    resetDatabase()
+    logOut()
+    addCategories(2, 2)
+    urls = ['/', '/catalog.json', '/catalog/Category 0/', '/catalog/Category 0/Item 0']
+    etags = {}
+    for url in urls:
+        etags[url] = client.get(url).headers.get('ETag')
+        if etags[url] is None:
+            raise ValueError("{u} should respond with an ETag.".format(u=url))
+        response = client.get(url, headers={'If-None-Match': etags[url]})
+        if response.status_code != 304:
+            raise ValueError("{u} should respond with a 304 for a current ETag. Got {c}".format(
+                u=url, c=response.status_code))
+    print "4. Read routes respond with a 304 when the client holds the current version."
+    logIn()
+    for url in urls:
+        response = client.get(url, headers={'If-None-Match': etags[url]})
+        if response.status_code != 200:
+            raise ValueError("{u} should not respond with a 304 for another user.".format(u=url))
+    logOut()
+    print "5. ETags are not shared between anonymous and logged in users."
+    category_1 = client.get('/catalog/Category 1/').headers.get('ETag')
+    logIn()
+    client.post('/catalog/Category 0/Item 0/edit/', data={
+        'category': 'Category 0', 'name': 'Item 0', 'description': 'Edited'})
+    logOut()
+    for url in urls:
+        response = client.get(url, headers={'If-None-Match': etags[url]})
+        if response.status_code != 200:
+            raise ValueError("{u} should respond with a 200 after an edit.".format(u=url))
+    response = client.get('/catalog/Category 1/', headers={'If-None-Match': category_1})
+    if response.status_code != 304:
+        raise ValueError("An edit should not change the ETag of an unrelated category.")
+    print "6. Editing an item only changes the ETags of the pages built from it."
+
+
+def testPageCache():
+    """
+    Test that category and item pages are cached until a write evicts exactly those it affects.
+    """
+    resetDatabase()
+    logOut()
+    addCategories(2, 2)
+    urls = ['/catalog/Category 0/', '/catalog/Category 0/Item 0', '/catalog/Category 1/']
+    for url in urls:
+        client.get(url)
+    before = json.loads(client.get('/admin/cache.json').data)
+    for url in urls:
+        client.get(url)
+    after = json.loads(client.get('/admin/cache.json').data)
+    if after['hits'] - before['hits'] != 3 or after['misses'] != before['misses']:
+        raise ValueError("Repeated requests for a page should be served from the page cache.")
+    if after['size'] != 3:
+        raise ValueError("The page cache should hold 3 pages. Got {s}".format(s=after['size']))
+    application.app.config['ADMIN_ENDPOINTS'] = False
+    try:
+        if client.get('/admin/cache.json').status_code != 302:
+            raise ValueError("The page cache counters should only be served when asked for.")
+    finally:
+        application.app.config['ADMIN_ENDPOINTS'] = True
+    print "7. Category and item pages are served from the page cache."
+    logIn()
+    client.post('/catalog/Category 0/Item 0/delete/')
+    logOut()
+    before, after = after, json.loads(client.get('/admin/cache.json').data)
+    if after['size'] != 1 or after['invalidations'] - before['invalidations'] != 2:
+        raise ValueError("Deleting an item should evict its page and its category page only.")
+    if client.get('/catalog/Category 0/').data.count('Item 0') != 0:
+        raise ValueError("A deleted item should not be listed by its category page.")
+    print "8. Deleting an item evicts exactly the pages it affects from the page cache."
+
+
+def testDuplicateItemNames():
+    """
+    Test that item names are unique within a category but not across categories.
+    """
+    resetDatabase()
+    addCategories(2, 1)
+    logIn()
+    client.post('/catalog/add/', data={
+        'category': 'Category 0', 'name': 'Item 0', 'description': 'Duplicate'})
+    response = client.get('/catalog/Category 0/')
+    if 'already exists' not in response.data:
+        raise ValueError("Adding a duplicate item should alert the user.")
+    client.post('/catalog/Category 1/Item 0/edit/', data={
+        'category': 'Category 0', 'name': 'Item 0', 'description': 'Duplicate'})
+    client.post('/catalog/add/', data={
+        'category': 'Category 1', 'name': 'Item 1', 'description': 'Unique'})
+    response = client.post('/catalog/Category 1/Item 1/edit/', data={
+        'category': 'Category 1', 'name': 'Item 0', 'description': 'Renamed'})
+    if 'Server error' in client.get(response.location).data:
+        raise ValueError("Renaming an item to a duplicate should not be a server error.")
+    logOut()
+    counts = [len(category.items) for category in
+        application.database_session.query(Category).order_by(Category.id)]
+    if counts != [1, 2]:
+        raise ValueError("Duplicate items should be rejected. Got {c} items".format(c=counts))
+    print "9. Item names must be unique within their category."
+
+
+def testSessionPerRequest():
+    """
+    Test that concurrent requests get their own sessions and failed requests leave no trace.
+    """
+    resetDatabase()
+    addCategories(5, 5)
+    application.database_session.remove()
+    response = client.get('/catalog/Missing/')
+    if response.status_code != 302:
+        raise ValueError("A missing category should redirect to the homepage.")
+    if client.get('/catalog/Category 0/').status_code != 200:
+        raise ValueError("A failed request should not break the requests that follow it.")
+    print "10. A failed request does not break the requests that follow it."
+    failures = []
+
+    def browse():
+        thread_client = application.app.test_client()
+        for i in xrange(20):
+            for url in ['/catalog.json', '/catalog/Category %d/' % (i % 5)]:
+                if thread_client.get(url).status_code != 200:
+                    failures.append(url)
+
+    threads = [threading.Thread(target=browse) for i in xrange(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise ValueError("Concurrent requests should all succeed. {f} failed".format(
+            f=len(failures)))
+    print "11. Concurrent requests from several threads all succeed."
+
+
+def testSQLitePerformanceMode():
+    """
+    Test that SQLite performance mode writes through a separate engine with WAL journaling.
+    """
+    directory = tempfile.mkdtemp()
+    url = 'sqlite:///%s' % os.path.join(directory, 'catalog.db')
+    try:
+        reader, writer = createEngines(url, performance=True)
+        if reader is writer:
+            raise ValueError("Performance mode should write through a separate engine.")
+        if writer.pool.size() != 1:
+            raise ValueError("Performance mode should write through a single connection.")
+        engines = (application.engine, application.writer_engine)
+        application.engine, application.writer_engine = reader, writer
+        try:
+            with application.app.test_request_context('/catalog/add/', method='POST'):
+                application.database_session()
+                application.app.preprocess_request()
+                if application.database_session.get_bind() is not writer:
+                    raise ValueError("A write should go through the writer, even in a session "
+                        "that already exists.")
+        finally:
+            application.engine, application.writer_engine = engines
+        for mode_engine in (reader, writer):
+            if mode_engine.execute('pragma journal_mode').scalar() != 'wal':
+                raise ValueError("Performance mode should use WAL journaling.")
+            mode_engine.dispose()
+        reader, writer = createEngines(url, performance=False)
+        if reader is not writer:
+            raise ValueError("Reads and writes should share an engine by default.")
+        reader.dispose()
+    finally:
+        shutil.rmtree(directory)
+    print "12. SQLite performance mode writes through a single WAL mode connection."
+
+
+def testBulkLoad():
+    """
+    Test that the bulk loader inserts items in batches and resolves categories and users by name.
+    """
+    resetDatabase()
+    addCategories(1, 0)
+    etag = client.get('/catalog/Category 0/').headers.get('ETag')
+    records = [{'category': 'Category %d' % (i % 2), 'name': 'Item %d' % i, 'description': 'Bulk'}
+        for i in xrange(25)]
+    records[0]['user'] = 'loader@test.com'
+    def loadRecords():
+        # Create an item through the site midway through the load
+        for i, record in enumerate(records):
+            if i == 15:
+                logIn()
+                client.post('/catalog/add/', data={
+                    'category': 'Category 0', 'name': 'Site Item', 'description': 'Bulk'})
+                logOut()
+            yield record
+    loaded, seconds = loader.loadItems(engine, loadRecords(), owner='owner@test.com',
+        batch_size=10, rebuild_indexes=True)
+    if loaded != 25:
+        raise ValueError("The loader should load all 25 items. Got {l}".format(l=loaded))
+    counts = [len(category.items) for category in
+        application.database_session.query(Category).order_by(Category.id)]
+    if counts != [14, 12]:
+        raise ValueError("Loaded items should be spread over an existing and a new category.")
+    users = [user.email for user in application.database_session.query(User).order_by(User.id)]
+    if users != ['owner@test.com', 'loader@test.com']:
+        raise ValueError("Loaded items should be owned by existing or newly created users.")
+    if client.get('/catalog/Category 0/', headers={'If-None-Match': etag}).status_code != 200:
+        raise ValueError("Loading items into a category should change its ETag.")
+    if len(json.loads(client.get('/catalog/search.json?q=bulk').data)['items']) != 26:
+        raise ValueError("Loaded items should be added to the search index.")
+    print "13. The bulk loader inserts items and resolves their categories and users."
+
+
+def testPagination():
+    """
+    Test that category pages and their JSON API list every item once, a page at a time.
+    """
+    resetDatabase()
+    addCategories(1, 25)
+    application.app.config['CATEGORY_PAGE_SIZE'] = 10
+    try:
+        names = []
+        sizes = []
+        url = '/catalog/Category 0.json'
+        while url is not None:
+            page = json.loads(client.get(url).data)
+            names += [item['name'] for item in page['items']]
+            sizes.append(len(page['items']))
+            url = page['next'] and '/catalog/Category 0.json?after=%s' % page['next']
+        first_page = client.get('/catalog/Category 0/').data
+    finally:
+        application.app.config['CATEGORY_PAGE_SIZE'] = 50
+    if sizes != [10, 10, 5]:
+        raise ValueError("25 items should be listed over pages of 10, 10 and 5. Got {s}".format(
+            s=sizes))
+    if names != sorted('Item %d' % i for i in xrange(25)):
+        raise ValueError("Every item should be listed exactly once, in order of name.")
+    if 'Next page' not in first_page or first_page.count('list-group-item-heading') != 10:
+        raise ValueError("The category page should list the first page and link to the next.")
+    if client.get('/catalog/Category 0.json?after=nonsense').status_code != 302:
+        raise ValueError("An invalid cursor should be treated as a missing page.")
+    print "14. Category pages list every item once, a page at a time."
+
+
+def testSearch():
+    """
+    Test that searches find items by prefixes of their words, and follow every write to them.
+    """
+    for index in (search.createSearchIndex, search.InvertedIndex):
+        resetDatabase()
+        addCategories(2, 3)
+        application.search_index = index(engine)
+        logIn()
+        client.post('/catalog/add/', data={
+            'category': 'Category 1', 'name': 'Hippie Sweater', 'description': 'Warm sweater'})
+        client.post('/catalog/add/', data={
+            'category': 'Category 0', 'name': 'Sweat Band', 'description': 'Item of clothing'})
+        results = json.loads(client.get('/catalog/search.json?q=swea').data)['items']
+        if [item['name'] for item in results] != ['Hippie Sweater', 'Sweat Band']:
+            raise ValueError("A search should rank items by how well they match. Got {r}".format(
+                r=results))
+        if results[0]['category'] != 'Category 1':
+            raise ValueError("Search results should name the category of each item.")
+        results = json.loads(client.get('/catalog/search.json?q=item+2+categ+1').data)['items']
+        if [item['description'] for item in results] != ['Item 2 of category 1']:
+            raise ValueError("A search should only find items matching every word.")
+        client.post('/catalog/Category 1/Hippie Sweater/edit/', data={
+            'category': 'Category 1', 'name': 'Hippie Vest', 'description': 'Warm vest'})
+        client.post('/catalog/Category 0/Sweat Band/delete/')
+        logOut()
+        if json.loads(client.get('/catalog/search.json?q=swea').data)['items']:
+            raise ValueError("Edited and deleted items should no longer be found by old words.")
+        if 'Hippie Vest' not in client.get('/catalog/search?q=vest').data:
+            raise ValueError("Edited items should be found by their new words.")
+        database_session = application.database_session
+        item = Item(name='Phantom', description='Rolled back', category_id=1)
+        database_session.add(item)
+        database_session.flush()
+        application.search_index.add(database_session, item)
+        database_session.rollback()
+        if application.search_index.search(database_session, 'phantom', 10):
+            raise ValueError("Items rolled back should not be found.")
+        database_session.remove()
+    print "15. Searches find items by word prefixes and follow every write to them."
+
+
+def testOAuthLogin():
+    """
+    Test the login flow against a stub OAuth server, caching verified tokens and reusing users.
+    """
+    resetDatabase()
+    stub = StubOAuthServer('test')
+    stub.start()
+    directory = tempfile.mkdtemp()
+    google_client = application.google_client
+    application.google_client = GoogleClient(stub.writeClientSecrets(directory),
+        api_url=stub.url, accounts_url=stub.url)
+    try:
+        def logInWithGoogle(login_client, code):
+            with login_client.session_transaction() as session:
+                session['state'] = 'state'
+            return login_client.post('/oauth?state=state', data=code)
+        first_client = application.app.test_client()
+        second_client = application.app.test_client()
+        if logInWithGoogle(first_client, 'alice').data != 'Success':
+            raise ValueError("Logging in through the stub OAuth server should succeed.")
+        logInWithGoogle(first_client, 'alice')
+        logInWithGoogle(second_client, 'alice')
+        with second_client.session_transaction() as session:
+            if session.get('email') != 'alice@example.com':
+                raise ValueError("A login should store the user information in the session.")
+        users = application.database_session.query(User).all()
+        application.database_session.remove()
+        if [(user.id, user.email) for user in users] != [(1, 'alice@example.com')]:
+            raise ValueError("Logging in again should reuse the user. Got {u}".format(
+                u=[(user.id, user.email) for user in users]))
+        if stub.requests.get('/oauth2/v1/tokeninfo') != 3:
+            raise ValueError("Every login should verify its new token.")
+        if stub.requests.get('/oauth2/v1/userinfo') != 1:
+            raise ValueError("A user logging in again should be looked up once while cached.")
+        if stub.connections >= sum(stub.requests.values()):
+            raise ValueError("Requests to Google should reuse kept-alive connections.")
+        if first_client.post('/oauth?state=forged', data='alice').status_code != 401:
+            raise ValueError("A login with a mismatched state should be refused.")
+        first_client.get('/deauth/')
+        with first_client.session_transaction() as session:
+            if 'user_id' in session or stub.requests.get('/o/oauth2/revoke') != 1:
+                raise ValueError("Logging out should revoke the token and clear the session.")
+        logInWithGoogle(first_client, 'alice')
+        if stub.requests.get('/oauth2/v1/tokeninfo') != 4:
+            raise ValueError("A login after logging out should verify its new token.")
+    finally:
+        application.google_client = google_client
+        stub.stop()
+        shutil.rmtree(directory)
+    print "16. Logins verify every token, cache users and reuse connections to Google and users."
+
+
+def testProfiling():
+    """
+    Test that profiled requests are timed per endpoint and sampled ones are run under cProfile.
+    """
+    resetDatabase()
+    addCategories(1, 1)
+    profiler = application.profiler
+    directory = tempfile.mkdtemp()
+    profiler.clear()
+    profiler.enabled = True
+    profiler.sample_rate = 1
+    profiler.directory = directory
+    try:
+        client.get('/catalog/Category 0/Item 0', buffered=True)
+        client.get('/catalog/Category 0/Item 0', buffered=True)
+        stats = json.loads(client.get('/admin/profile.json').data)
+        item = stats.get('showItem')
+        if item is None or item['requests'] != 2 or item['wall']['count'] != 2:
+            raise ValueError("Every request should be recorded under its endpoint. Got {s}".format(
+                s=stats))
+        if item['queries'] < 2 or item['sql']['total_ms'] <= 0:
+            raise ValueError("The queries of a request should be counted and timed.")
+        if item['template']['total_ms'] <= 0 or item['session']['total_ms'] <= 0:
+            raise ValueError("Template rendering and sessions should be timed.")
+        if sum(bucket['count'] for bucket in item['wall']['buckets']) != 2:
+            raise ValueError("Every request should fall into a histogram bucket.")
+        if len([name for name in os.listdir(directory) if name.startswith('showItem-')]) != 2:
+            raise ValueError("Sampled requests should have their cProfile output written.")
+    finally:
+        profiler.enabled = False
+        profiler.sample_rate = 0
+        shutil.rmtree(directory)
+    if client.get('/admin/profile.json').status_code != 302:
+        raise ValueError("The profile should not be served while profiling is off.")
+    print "17. Profiled requests are timed per endpoint and sampled ones run under cProfile."
+
+
+def testAppFactory():
+    """
+    Test that importing the app sets nothing up, and createApp caches templates and warms the pool.
+    """
+    directory = tempfile.mkdtemp()
+    catalog_directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        # Import the app where there is neither a client secrets file nor a database to open
+        process = subprocess.Popen([sys.executable, '-c', 'import application'],
+            cwd=directory, stderr=subprocess.PIPE, env=dict(os.environ,
+                PYTHONPATH=os.pathsep.join([catalog_directory, os.environ.get('PYTHONPATH', '')])))
+        if process.wait() != 0 or os.listdir(directory):
+            raise ValueError("Importing the app should read and write no files. Got {e}".format(
+                e=process.stderr.read()))
+        application.app.config['TEMPLATE_CACHE_DIRECTORY'] = directory
+        application.app.jinja_env.cache.clear()
+        application.createApp(warm=True)
+        if len(os.listdir(directory)) != len(application.app.jinja_env.list_templates()):
+            raise ValueError("Every template should be compiled into the bytecode cache.")
+        if hasattr(engine.pool, 'checkedin') and engine.pool.checkedin() < engine.pool.size():
+            raise ValueError("Warming the app up should fill the connection pool.")
+    finally:
+        application.app.jinja_env.bytecode_cache = None
+        shutil.rmtree(directory)
+    print "18. Importing the app sets nothing up, and createApp caches templates and warms up."
+
+
+def testServerSideSessions():
+    """
+    Test that every server side session backend keeps sessions, expires them and revokes them.
+    """
+    resetDatabase()
+    addCategories(1, 1)
+    directory = tempfile.mkdtemp()
+    session_interface = application.app.session_interface
+    try:
+        for backend in ('memory', 'sqlite', 'file'):
+            store = createSessionStore(backend, path=os.path.join(directory, backend))
+            application.app.session_interface = ServerSideSessionInterface(store,
+                cleanup_interval=0)
+            session_client = application.app.test_client()
+            with session_client.session_transaction() as session:
+                session['name'] = "Test Owner"
+                session['email'] = "owner@test.com"
+                session['user_id'] = 1
+            cookie = next(cookie for cookie in session_client.cookie_jar
+                if cookie.name == application.app.session_cookie_name)
+            if len(cookie.value) != 22 or len(store) != 1:
+                raise ValueError("Only a short session id should be kept in the cookie.")
+            if 'Logout owner@test.com' not in session_client.get('/catalog/').data:
+                raise ValueError("The {b} backend should keep the session.".format(b=backend))
+            with session_client.session_transaction() as session:
+                session['user_id'] = 2
+            rotated = next(cookie for cookie in session_client.cookie_jar
+                if cookie.name == application.app.session_cookie_name)
+            if rotated.value == cookie.value or store.get(cookie.value) is not None:
+                raise ValueError("Changing the user should give the session a new id.")
+            with session_client.session_transaction() as session:
+                session['user_id'] = 1
+            cookie = next(cookie for cookie in session_client.cookie_jar
+                if cookie.name == application.app.session_cookie_name)
+            store.set(cookie.value, store.get(cookie.value)[0], 0, 1)
+            if 'Logout' in session_client.get('/catalog/').data:
+                raise ValueError("The {b} backend should expire sessions.".format(b=backend))
+            with session_client.session_transaction() as session:
+                session['user_id'] = 1
+            with application.app.test_client().session_transaction() as session:
+                session['user_id'] = 2
+            application.app.session_interface.cleanup()
+            if len(store) != 2:
+                raise ValueError("Expired sessions should be cleaned up.")
+            application.app.session_interface.revoke(1)
+            with session_client.session_transaction() as session:
+                if session or len(store) != 1:
+                    raise ValueError("Revoking a user should end their sessions only.")
+    finally:
+        application.app.session_interface = session_interface
+        shutil.rmtree(directory)
+    print "19. Server side sessions are kept, rotated, expired and revoked by every backend."
+
+
+def testItemCounts():
+    """
+    Test that the item counts of categories follow every write, and can be rebuilt.
+    """
+    resetDatabase()
+    addCategories(2, 3)
+    def counts():
+        item_counts = [count for count, in application.database_session.query(
+            Category.item_count).order_by(Category.name)]
+        application.database_session.remove()
+        return item_counts
+    logIn()
+    client.post('/catalog/add/', data={
+        'category': 'Category 0', 'name': 'New Item', 'description': 'Added'})
+    if counts() != [4, 3]:
+        raise ValueError("Adding an item should count it. Got {c}".format(c=counts()))
+    client.post('/catalog/Category 0/New Item/edit/', data={
+        'category': 'Category 1', 'name': 'New Item', 'description': 'Moved'})
+    client.post('/catalog/Category 1/Item 0/edit/', data={
+        'category': 'Category 1', 'name': 'Old Item', 'description': 'Renamed'})
+    if counts() != [3, 4]:
+        raise ValueError("Moving an item should move its count. Got {c}".format(c=counts()))
+    client.post('/catalog/Category 1/New Item/delete/')
+    logOut()
+    if counts() != [3, 3]:
+        raise ValueError("Deleting an item should uncount it. Got {c}".format(c=counts()))
+    page = client.get('/catalog/').data
+    if page.count('<span class="badge">3</span>') != 2:
+        raise ValueError("The home page should show the item count of every category.")
+    loader.loadItems(writer_engine, [{'category': 'Category 2', 'name': 'Item 0'},
+        {'category': 'Category 0', 'name': 'Loaded Item'}], owner='owner@test.com')
+    if counts() != [4, 3, 1]:
+        raise ValueError("Loading items should count them. Got {c}".format(c=counts()))
+    writer_engine.execute(Category.__table__.update().values(item_count=0))
+    reconcileItemCounts(writer_engine)
+    if counts() != [4, 3, 1]:
+        raise ValueError("Reconciling should rebuild the item counts. Got {c}".format(c=counts()))
+    print "20. Item counts follow every write and can be rebuilt in one statement."
+
+
+def testBulkImportExport():
+    """
+    Test that bulk imports apply rows in batches with a result each, and exports can be filtered.
+    """
+    resetDatabase()
+    addCategories(2, 2)
+    application.database_session.add(User(name="Other User", email="other@test.com"))
+    application.database_session.commit()
+    def ndjson(response):
+        return [json.loads(line) for line in response.data.splitlines()]
+    if client.get('/catalog/export.ndjson').status_code != 401 or client.post(
+            '/catalog/import', data='').status_code != 401:
+        raise ValueError("Bulk endpoints should only be open to logged in users.")
+    batch_size = application.app.config['IMPORT_BATCH_SIZE']
+    application.app.config['IMPORT_BATCH_SIZE'] = 2
+    try:
+        logIn()
+        rows = [
+            {'action': 'create', 'category': 'Category 0', 'name': 'New', 'description': 'A'},
+            {'action': 'create', 'category': 'Category 0', 'name': 'New', 'description': 'B'},
+            {'action': 'update', 'category': 'Category 0', 'name': 'Item 0',
+                'new_category': 'Category 1', 'new_name': 'Moved'},
+            {'action': 'delete', 'category': 'Category 1', 'name': 'Item 1'},
+            {'action': 'create', 'category': 'Category 9', 'name': 'Lost', 'description': 'C'}]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        results = ndjson(client.post('/catalog/import', data=body))
+        statuses = [result['status'] for result in results]
+        if statuses != ['created', 'error', 'updated', 'deleted', 'error', 'error']:
+            raise ValueError("Every row should get its own result. Got {s}".format(s=statuses))
+        if [result['row'] for result in results] != range(1, 7):
+            raise ValueError("Results should be numbered by row.")
+        version = application.database_session.query(CatalogVersion.version).scalar()
+        application.database_session.remove()
+        logIn(2)
+        results = ndjson(client.post('/catalog/import', data=json.dumps(
+            {'action': 'delete', 'category': 'Category 0', 'name': 'New'})))
+        if results[0]['error'] != 'Item does not belong to you':
+            raise ValueError("Imports should only change items owned by the user.")
+        results = ndjson(client.post('/catalog/import', data=json.dumps(
+            {'action': 'create', 'category': u'Cat\xe9gorie', 'name': 'New', 'description': 'D'})))
+        if results[0]['error'] != u'There is no category named Cat\xe9gorie':
+            raise ValueError("Errors about non-ASCII names should be reported.")
+        if application.database_session.query(CatalogVersion.version).scalar() != version:
+            raise ValueError("A batch whose every row failed should not bump the version.")
+        application.database_session.remove()
+    finally:
+        application.app.config['IMPORT_BATCH_SIZE'] = batch_size
+    item_counts = [count for count, in application.database_session.query(
+        Category.item_count).order_by(Category.name)]
+    if item_counts != [2, 2]:
+        raise ValueError("Imports should keep item counts. Got {c}".format(c=item_counts))
+    if client.get('/catalog/search.json?q=moved').data.count('"Moved"') != 1:
+        raise ValueError("Imports should keep the search index up to date.")
+    records = ndjson(client.get('/catalog/export.ndjson'))
+    if [record['name'] for record in records] != ['Moved', 'Item 1', 'Item 0', 'New']:
+        raise ValueError("The export should hold every item in order.")
+    if records[3]['category'] != 'Category 0' or records[3]['user_id'] != 1:
+        raise ValueError("Exported items should name their category and owner.")
+    since = records[3]['modified']
+    records = ndjson(client.get('/catalog/export.ndjson?category=Category 1'))
+    if [record['name'] for record in records] != ['Moved', 'Item 0']:
+        raise ValueError("The export should be filterable by category.")
+    records = ndjson(client.get('/catalog/export.ndjson?since=' + since))
+    if [record['name'] for record in records] != ['Moved', 'New']:
+        raise ValueError("The export should be filterable by modification time.")
+    if client.get('/catalog/export.ndjson?since=yesterday').status_code != 400:
+        raise ValueError("Invalid times should be rejected.")
+    logOut()
+    print "21. Bulk imports apply batches of rows with a result each, and exports are filtered."
+
+
+def testChangeFeed():
+    """
+    Test that every write to items is logged, and clients can sync from the log or wait on it.
+    """
+    resetDatabase()
+    addCategories(2, 1)
+    def changes(query=''):
+        return json.loads(client.get('/catalog/changes' + query).data)
+    logIn()
+    client.post('/catalog/add/', data={
+        'category': 'Category 0', 'name': 'New Item', 'description': 'Added'})
+    client.post('/catalog/Category 0/New Item/edit/', data={
+        'category': 'Category 1', 'name': 'New Item', 'description': 'Moved'})
+    client.post('/catalog/Category 1/Item 0/delete/')
+    client.post('/catalog/import', data=json.dumps(
+        {'action': 'create', 'category': 'Category 0', 'name': 'Imported', 'description': 'I'}))
+    feed = changes()
+    if [(change['action'], change['category'], change['name']) for change in feed['changes']] != [
+            ('create', 'Category 0', 'New Item'), ('update', 'Category 1', 'New Item'),
+            ('delete', 'Category 1', 'Item 0'), ('create', 'Category 0', 'Imported')]:
+        raise ValueError("Every write should be logged in order. Got {c}".format(c=feed))
+    if feed['last_seq'] != feed['changes'][-1]['seq'] or feed['more']:
+        raise ValueError("The feed should point at the last change it holds.")
+    first = feed['changes'][0]['seq']
+    feed = changes('?since={s}&limit=2'.format(s=first))
+    if [change['action'] for change in feed['changes']] != ['update', 'delete'] or (
+            not feed['more']):
+        raise ValueError("The feed should page through the changes after since.")
+    last_seq = changes()['last_seq']
+    loader.loadItems(writer_engine, [{'category': 'Category 1', 'name': 'Loaded'}],
+        owner='owner@test.com')
+    feed = changes('?since={s}'.format(s=last_seq))
+    if [change['name'] for change in feed['changes']] != ['Loaded']:
+        raise ValueError("Loaded items should be logged.")
+    last_seq = feed['last_seq']
+    if changes('?since={s}&wait=0.1'.format(s=last_seq)) != {
+            'changes': [], 'last_seq': last_seq, 'more': False}:
+        raise ValueError("Waiting without a change should return none.")
+    writer = application.app.test_client()
+    with writer.session_transaction() as session:
+        session['name'] = "Test Owner"
+        session['user_id'] = 1
+    thread = threading.Timer(0.2, lambda: writer.post('/catalog/add/', data={
+        'category': 'Category 1', 'name': 'Awaited', 'description': 'Waited for'}))
+    thread.start()
+    poll_interval = application.app.config['CHANGES_POLL_INTERVAL']
+    application.app.config['CHANGES_POLL_INTERVAL'] = 10
+    start = time.time()
+    try:
+        feed = changes('?since={s}&wait=5'.format(s=last_seq))
+    finally:
+        application.app.config['CHANGES_POLL_INTERVAL'] = poll_interval
+        thread.join()
+    if [change['name'] for change in feed['changes']] != ['Awaited'] or time.time() - start > 2:
+        raise ValueError("Waiting clients should get the next change once it is committed.")
+    if client.get('/catalog/changes?since=first').status_code != 400:
+        raise ValueError("Invalid sequence numbers should be rejected.")
+    logOut()
+    print "22. Every write to items is logged, and clients can sync from the log or wait on it."
+
+
+if __name__ == '__main__':
+    testCatalogJSON()
+    testCatalogJSONQueryCount()
+    testCatalogJSONStream()
+    testConditionalRequests()
+    testPageCache()
+    testDuplicateItemNames()
+    testSessionPerRequest()
+    testSQLitePerformanceMode()
+    testBulkLoad()
+    testPagination()
+    testSearch()
+    testOAuthLogin()
+    testProfiling()
+    testAppFactory()
+    testServerSideSessions()
+    testItemCounts()
+    testBulkImportExport()
+    testChangeFeed()
+    print "Success!  All tests pass!"
@@ -1,6 +1,14 @@
-from sqlalchemy import create_engine, Column, ForeignKey, Integer, String
+import datetime
+import os
+
+from sqlalchemy import create_engine, event, func, inspect, literal, select
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import backref, relationship
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.schema import CreateColumn
 
 
 Base = declarative_base()
@@ -11,14 +19,21 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(128), nullable=False)
-    email = Column(String(128), nullable=False)
+    email = Column(String(128), nullable=False, unique=True, index=True)
 
 
 class Category(Base):
     __tablename__ = 'category'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(128), nullable=False)
+    name = Column(String(128), nullable=False, unique=True, index=True)
+
+    # Bumped whenever an item in this category is created, edited or deleted
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # The number of items in this category, kept up to date by every write so listing the counts
+    # of all categories needs no aggregate query
+    item_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     @property
     def serialize(self):
@@ -29,9 +44,27 @@ class Category(Base):
         }
 
 
+class CatalogVersion(Base):
+    __tablename__ = 'catalog_version'
+
+    # A single row counter which is bumped whenever any item in the catalog changes
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+@event.listens_for(CatalogVersion.__table__, 'after_create')
+def seedCatalogVersion(target, connection, **kw):
+    """Insert the catalog version row along with its table, so changes only ever update it."""
+
+    connection.execute(target.insert().values(id=1, version=0))
+
+
 class Item(Base):
     __tablename__ = 'item'
 
+    # Items are looked up by name within their category, so the pair must be unique
+    __table_args__ = (Index('ix_item_category_id_name', 'category_id', 'name', unique=True),)
+
     id = Column(Integer, primary_key=True)
     name = Column(String(128), nullable=False)
     description = Column(String(1024))
@@ -40,7 +73,12 @@ class Item(Base):
     user = relationship(User)
 
     category_id = Column(Integer, ForeignKey('category.id'))
-    category = relationship(Category)
+    category = relationship(Category, backref=backref('items', order_by=id))
+
+    # The UTC time the item was created or last changed at, indexed to export recent changes.
+    # Items created before this column was added have no time
+    modified = Column(DateTime, default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow, index=True)
 
     @property
     def serialize(self):
@@ -51,6 +89,264 @@ class Item(Base):
             'description': self.description
         }
 
-engine = create_engine('sqlite:///catalog.db')
 
-Base.metadata.create_all(engine)
+class ItemChange(Base):
+    __tablename__ = 'item_change'
+
+    # Change ids must only ever grow, so SQLite must not reuse them
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # The sequence number of the change, which clients sync from
+    id = Column(Integer, primary_key=True)
+    action = Column(String(16), nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    # The item as it was left by the change. Deleted items are gone, so this is not a foreign key
+    item_id = Column(Integer, nullable=False)
+    category_id = Column(Integer, nullable=False)
+    name = Column(String(128), nullable=False)
+    description = Column(String(1024))
+
+    @property
+    def serialize(self):
+        """Return object data in easily serializeable format"""
+        return {
+            'seq': self.id,
+            'action': self.action,
+            'item_id': self.item_id,
+            'category_id': self.category_id,
+            'name': self.name,
+            'description': self.description
+        }
+
+
+def createEngine(url=None, writer=False, performance=None):
+    """Create an engine for the catalog database, configured from the environment.
+
+    The database and its connection pool are configured by the following variables:
+      CATALOG_DATABASE_URL: the database to connect to (default sqlite:///catalog.db).
+      CATALOG_POOL_SIZE: the number of connections kept open (default 5).
+      CATALOG_POOL_MAX_OVERFLOW: how many more may be opened when all are in use (default 10).
+      CATALOG_POOL_RECYCLE: the age in seconds at which connections are replaced (default 3600).
+      CATALOG_POOL_PRE_PING: if set, test each connection before handing it out.
+      CATALOG_SQLITE_PERFORMANCE: if set, run a SQLite database in WAL mode, see setSQLitePragmas.
+      CATALOG_SQLITE_MMAP_SIZE: bytes of the database memory mapped in that mode (default 256MB).
+      CATALOG_SQLITE_CACHE_SIZE: KiB of page cache per connection in that mode (default 64MB).
+
+    Args:
+      url: the database to connect to, overriding CATALOG_DATABASE_URL.
+      writer: create the engine that writes go through, see createEngines.
+      performance: turn SQLite performance mode on or off, overriding CATALOG_SQLITE_PERFORMANCE.
+    """
+
+    url = make_url(url or os.environ.get('CATALOG_DATABASE_URL', 'sqlite:///catalog.db'))
+    options = {}
+
+    pool_size = int(os.environ.get('CATALOG_POOL_SIZE', 5))
+    max_overflow = int(os.environ.get('CATALOG_POOL_MAX_OVERFLOW', 10))
+
+    if url.drivername.startswith('sqlite'):
+        # Connections handed back to the pool are picked up by other threads, so SQLite must not
+        # tie them to the thread that opened them
+        options['connect_args'] = {'check_same_thread': False}
+
+        # An in-memory database only lives as long as its connection, so share a single one
+        if url.database in (None, '', ':memory:'):
+            options['poolclass'] = StaticPool
+            return create_engine(url, **options)
+
+        if performance is None:
+            performance = bool(os.environ.get('CATALOG_SQLITE_PERFORMANCE'))
+
+        # SQLite only lets one connection write at a time, so writers queue up for a single pooled
+        # connection rather than contending for the database lock
+        if performance and writer:
+            pool_size = 1
+            max_overflow = 0
+    else:
+        performance = False
+
+    engine = create_engine(url,
+        poolclass = QueuePool,
+        pool_size = pool_size,
+        max_overflow = max_overflow,
+        pool_recycle = int(os.environ.get('CATALOG_POOL_RECYCLE', 3600)),
+        pool_pre_ping = bool(os.environ.get('CATALOG_POOL_PRE_PING')),
+        **options
+    )
+
+    if performance:
+        event.listen(engine, 'connect', setSQLitePragmas)
+
+    return engine
+
+
+def createEngines(url=None, performance=None):
+    """Create the engines that reads and writes go through, as a (reader, writer) pair.
+
+    Both are the same engine, unless SQLite performance mode is on. Then reads are spread over a
+    pool of connections, while writes go through a separate single connection.
+    """
+
+    engine = createEngine(url, performance=performance)
+
+    if not event.contains(engine, 'connect', setSQLitePragmas):
+        return engine, engine
+
+    return engine, createEngine(url, writer=True, performance=performance)
+
+
+def setSQLitePragmas(dbapi_connection, connection_record):
+    """Tune a new SQLite connection for concurrent reads and writes.
+
+    Write-ahead logging lets readers carry on while a write is in progress, and only syncing at
+    checkpoints is safe in that mode, though the last commits may be lost on power failure.
+    """
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute('pragma journal_mode = wal')
+    cursor.execute('pragma synchronous = normal')
+    cursor.execute('pragma mmap_size = %d' % int(
+        os.environ.get('CATALOG_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)))
+    cursor.execute('pragma cache_size = -%d' % int(
+        os.environ.get('CATALOG_SQLITE_CACHE_SIZE', 64 * 1024)))
+    cursor.close()
+
+
+def bumpVersions(connection, category_ids):
+    """Bump the version of the catalog and of the given categories as part of a change.
+
+    Call this before anything else that locks the rows of categories, such as adjustItemCounts.
+    Every writer then locks the single catalog version row first, so writers queue up behind it
+    rather than deadlocking over category rows locked in different orders.
+
+    Args:
+      connection: the session or connection making the change. The new versions become visible
+        along with the change itself once it is committed.
+      category_ids: the ids of the categories whose items were changed.
+    """
+
+    catalog_version = CatalogVersion.__table__
+    category = Category.__table__
+
+    # Increment the versions in the database so concurrent writers cannot lose an update. The
+    # catalog version row is created along with its table, so there is always one to update
+    connection.execute(catalog_version.update().values(version=catalog_version.c.version + 1))
+
+    if category_ids:
+        connection.execute(category.update().where(category.c.id.in_(category_ids)).values(
+            version=category.c.version + 1))
+
+
+def adjustItemCounts(connection, deltas):
+    """Adjust the item counts of categories as part of a change.
+
+    Args:
+      connection: the session or connection making the change.
+      deltas: a dictionary of category ids to the number of items added to them, or removed from
+        them if negative.
+    """
+
+    category = Category.__table__
+
+    # Add to the counts in the database so concurrent writers cannot lose an update
+    for category_id, delta in deltas.iteritems():
+        if delta:
+            connection.execute(category.update().where(category.c.id == category_id).values(
+                item_count=category.c.item_count + delta))
+
+
+def recordChanges(connection, changes):
+    """Append changes to items to the change log as part of a change.
+
+    Call this after bumpVersions, which every write calls first. Its update of the single catalog
+    version row keeps concurrent writers waiting until it commits. Changes then get their ids in
+    the order they are committed, so clients syncing past an id never miss a change committed
+    later with a lower one.
+
+    Args:
+      connection: the session or connection making the change.
+      changes: a list of pairs of the action taken, 'create', 'update' or 'delete', and the item
+        as it was left by it, in the order they were made.
+    """
+
+    if changes:
+        connection.execute(ItemChange.__table__.insert(), [{
+            'action': action,
+            'item_id': item.id,
+            'category_id': item.category_id,
+            'name': item.name,
+            'description': item.description
+        } for action, item in changes])
+
+
+def recordCreatedItems(connection, after_id):
+    """Append the creation of every item with an id above after_id to the change log."""
+
+    change = ItemChange.__table__
+    item = Item.__table__
+
+    connection.execute(change.insert().from_select(
+        ['action', 'created', 'item_id', 'category_id', 'name', 'description'],
+        select([literal('create'), item.c.modified, item.c.id, item.c.category_id, item.c.name,
+            item.c.description]).where(item.c.id > after_id).order_by(item.c.id)))
+
+
+def reconcileItemCounts(connection, category_ids=None):
+    """Recount the items of every category, or of the given ones, in a single statement."""
+
+    category = Category.__table__
+    item = Item.__table__
+
+    count = select([func.count(item.c.id)]).where(item.c.category_id == category.c.id)
+    statement = category.update().values(item_count=count.as_scalar())
+
+    if category_ids is not None:
+        statement = statement.where(category.c.id.in_(category_ids))
+
+    connection.execute(statement)
+
+
+def migrate(engine):
+    """Bring the schema of an existing database up to date with the models."""
+
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    # create_all only creates missing tables, so add any columns and indexes introduced since
+    # then by hand
+    for table in Base.metadata.sorted_tables:
+        existing_columns = [column['name'] for column in inspector.get_columns(table.name)]
+        existing_indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+
+        for column in table.columns:
+            if column.name not in existing_columns:
+                engine.execute('alter table %s add column %s' % (
+                    preparer.format_table(table), CreateColumn(column).compile(engine)))
+
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                # A unique index cannot be built over duplicate rows, which have to be cleaned
+                # up by hand before the index is created on the next run
+                try:
+                    index.create(engine)
+                except IntegrityError:
+                    print "Could not create index %s as %s holds duplicate rows." % (
+                        index.name, table.name)
+
+    # Databases created before the catalog version row was seeded along with its table only have
+    # one once the catalog first changed
+    catalog_version = CatalogVersion.__table__
+
+    if engine.execute(catalog_version.count()).scalar() == 0:
+        seedCatalogVersion(catalog_version, engine)
+
+
+if __name__ == '__main__':
+    engine = createEngine()
+
+    Base.metadata.create_all(engine)
+    migrate(engine)
+
+    # Rebuild the item counts, which also fills them in after the column was first added
+    reconcileItemCounts(engine)
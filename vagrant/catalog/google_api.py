@@ -0,0 +1,155 @@
+import httplib2
+import threading
+import time
+
+import requests
+
+from oauth2client.client import flow_from_clientsecrets
+from requests.adapters import HTTPAdapter
+
+
+class TTLCache(object):
+    """A cache whose entries expire a fixed number of seconds after they are stored."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        # Count the lookups which found an unexpired value and those which did not
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the value stored under the given key, or None if it is missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store a value under the given key, for the given or the default number of seconds."""
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            # Drop the expired entries every so often, so the cache cannot grow without bound
+            if len(self._entries) >= 1024 and len(self._entries) % 1024 == 0:
+                now = time.time()
+
+                for stale_key in [k for k, v in self._entries.iteritems() if v[0] <= now]:
+                    del self._entries[stale_key]
+
+            self._entries[key] = (time.time() + ttl, value)
+
+
+class GoogleClient(object):
+    """A client for the Google OAuth endpoints used to log users in and out.
+
+    Requests go over keep-alive connections, so only the first request to each host pays for the
+    TCP and TLS handshakes, and every request gives up after a timeout. Every login brings a new
+    access token, so tokens are always verified with Google, but the name and email of a user are
+    cached for a while under their Google id, so a user logging in again is not looked up again.
+
+    Args:
+      client_secrets: the path of the client secrets file of the app, which also names the URL
+        authorization codes are exchanged at.
+      api_url: the base URL of the token information and user information endpoints.
+      accounts_url: the base URL of the token revocation endpoint.
+      timeout: the number of seconds to wait for a response before giving up.
+      user_ttl: the number of seconds to cache the information of a user for.
+      pool_size: the number of connections kept open to each host.
+    """
+
+    def __init__(self, client_secrets, api_url='https://www.googleapis.com',
+            accounts_url='https://accounts.google.com', timeout=5, user_ttl=300, pool_size=10):
+        self.api_url = api_url
+        self.accounts_url = accounts_url
+        self.timeout = timeout
+        self.cache = TTLCache(user_ttl)
+
+        # Read the client secrets once, rather than on every login
+        self.flow = flow_from_clientsecrets(client_secrets, scope='')
+        self.flow.redirect_uri = 'postmessage'
+        self.client_id = self.flow.client_id
+
+        # The code exchange goes through httplib2, whose connections cannot be shared between
+        # threads, so give each thread a connection of its own to keep alive
+        self._local = threading.local()
+
+        # Share one session, and so one connection pool per host, between all request threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def exchangeCode(self, code):
+        """Upgrade an authorization code into a credentials object.
+
+        Raises:
+          FlowExchangeError: if Google refuses the code.
+        """
+
+        if not hasattr(self._local, 'http'):
+            self._local.http = httplib2.Http(timeout=self.timeout)
+
+        return self.flow.step2_exchange(code, http=self._local.http)
+
+    def verifyToken(self, access_token):
+        """Return Google's information about an access token, such as who it was issued to."""
+
+        return self._get(self.api_url + '/oauth2/v1/tokeninfo', {'access_token': access_token})
+
+    def getUserInfo(self, access_token, google_id):
+        """Return the name and email of the user an access token belongs to.
+
+        Args:
+          access_token: an access token, already verified to belong to the user.
+          google_id: the Google id of the user, which their information is cached under.
+        """
+
+        result = self.cache.get(google_id)
+
+        if result is None:
+            result = self._get(self.api_url + '/oauth2/v1/userinfo',
+                {'access_token': access_token, 'alt': 'json'})
+
+            if result.get('error') is None:
+                self.cache.set(google_id, result)
+
+        return result
+
+    def revokeToken(self, access_token):
+        """Revoke an access token and return the status code of Google's response.
+
+        Returns:
+          The status code of the response, or None if Google could not be reached in time.
+        """
+
+        try:
+            return self.session.get(self.accounts_url + '/o/oauth2/revoke',
+                params={'token': access_token}, timeout=self.timeout).status_code
+        except requests.RequestException:
+            return None
+
+    def _get(self, url, parameters):
+        """Make a GET request and return its JSON response, or an error if the request failed."""
+
+        try:
+            return self.session.get(url, params=parameters, timeout=self.timeout).json()
+        except (requests.RequestException, ValueError) as error:
+            return {'error': 'Request to Google failed: %s' % error}
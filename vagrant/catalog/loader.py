@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# loader.py -- bulk load items into the catalog database
+#
+# Items are read from CSV or JSON Lines files, one item per row, with the fields
+#   category: the name of the category the item belongs to, created if it does not exist yet.
+#   name: the name of the item.
+#   description: the description of the item.
+#   user: the email of the user who owns the item, created if they do not exist yet.
+#     Rows without a user are owned by the user given with --owner.
+#
+#     $ python loader.py items.csv more_items.jsonl --owner owner@house.com
+#
+
+import argparse
+import csv
+import json
+import sys
+
+from collections import Counter
+from database_setup import createEngine, adjustItemCounts, bumpVersions, recordCreatedItems
+from database_setup import User, Category, Item
+from search import createSearchIndex
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from timeit import default_timer as timer
+
+
+# HELPER FUNCTIONS ================================================================================
+
+def readRecords(path):
+    """Generate the item records in a CSV or JSON Lines file, one at a time."""
+
+    with open(path, 'rb') as records:
+        if path.endswith('.csv'):
+            for record in csv.DictReader(records):
+                yield dict((key, value.decode('utf-8')) for key, value in record.iteritems())
+        else:
+            for line in records:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def loadItems(engine, records, owner=None, batch_size=10000, rebuild_indexes=False,
+        progress=None):
+    """Insert items into the catalog in batches, creating their categories and users as needed.
+
+    Args:
+      engine: the engine of the catalog database to load into.
+      records: an iterable of item records, as described at the top of this file.
+      owner: the email of the user who owns items without a user of their own.
+      batch_size: the number of items inserted per statement and transaction.
+      rebuild_indexes: drop the item indexes for the duration of the load and rebuild them after,
+        which is faster for large loads into a large table.
+      progress: a function called with the number of items loaded and the seconds taken so far
+        after every batch.
+
+    Returns:
+      A tuple of the number of items loaded and the seconds it took.
+    """
+
+    start = timer()
+    loaded = 0
+
+    # Set up the search index before loading, so only the loaded items need to be added to it.
+    # Setting it up may take a connection of its own, so do so before holding on to one
+    search_index = createSearchIndex(engine)
+
+    connection = engine.connect()
+
+    # Map names to ids in memory, so resolving the foreign keys of a row needs no query
+    category_ids = dict((name, id) for id, name in connection.execute(
+        select([Category.id, Category.name])))
+    user_ids = dict((email, id) for id, email in connection.execute(
+        select([User.id, User.email])))
+
+    def resolve(ids, table, key, values):
+        """Return the id of the row with the given key, inserting the row if it does not exist."""
+
+        if key not in ids:
+            ids[key] = connection.execute(table.insert(), values).inserted_primary_key[0]
+
+        return ids[key]
+
+    def insert(batch):
+        """Insert, count, log and index a batch of items in a single statement and transaction.
+
+        The versions of the categories loaded into are bumped first, which puts the batch in line
+        behind concurrent writers, so the items inserted are the only ones above the highest id
+        beforehand and are logged and indexed in order, see recordChanges.
+        """
+
+        with connection.begin():
+            bumpVersions(connection, set(item['category_id'] for item in batch))
+            after_id = connection.execute(select([func.max(Item.id)])).scalar() or 0
+            connection.execute(Item.__table__.insert(), batch)
+            adjustItemCounts(connection, Counter(item['category_id'] for item in batch))
+            recordCreatedItems(connection, after_id)
+            search_index.addItems(connection, after_id)
+
+    if rebuild_indexes:
+        for index in Item.__table__.indexes:
+            index.drop(connection)
+
+    try:
+        batch = []
+
+        for record in records:
+            category = record['category']
+            email = record.get('user') or owner
+
+            if email is None:
+                raise ValueError('Item %s has no user and no owner was given' % record['name'])
+
+            batch.append({
+                'name': record['name'],
+                'description': record.get('description'),
+                'category_id': resolve(category_ids, Category.__table__, category,
+                    {'name': category}),
+                'user_id': resolve(user_ids, User.__table__, email,
+                    {'name': email, 'email': email})
+            })
+
+            if len(batch) >= batch_size:
+                insert(batch)
+                loaded += len(batch)
+                batch = []
+
+                if progress is not None:
+                    progress(loaded, timer() - start)
+
+        if batch:
+            insert(batch)
+            loaded += len(batch)
+    finally:
+        if rebuild_indexes:
+            for index in Item.__table__.indexes:
+                # Duplicate items make the unique index impossible to rebuild, so point them out
+                try:
+                    index.create(connection)
+                except IntegrityError:
+                    print >> sys.stderr, "Could not rebuild index %s as item holds duplicate " \
+                        "rows." % index.name
+
+        connection.close()
+
+    return loaded, timer() - start
+
+
+def printProgress(loaded, seconds):
+    """Print the number of items loaded so far and the rate they are being loaded at."""
+
+    print '%d items loaded in %.1f seconds (%.0f rows/s)' % (
+        loaded, seconds, loaded / seconds if seconds else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk load items into the catalog database.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+        help='a .csv or .jsonl file of items to load')
+    parser.add_argument('--owner', help='the email of the user who owns items without a user')
+    parser.add_argument('--batch-size', type=int, default=10000,
+        help='the number of items inserted per transaction')
+    parser.add_argument('--rebuild-indexes', action='store_true',
+        help='drop the item indexes during the load and rebuild them after')
+
+    arguments = parser.parse_args()
+
+    records = (record for path in arguments.paths for record in readRecords(path))
+
+    loaded, seconds = loadItems(createEngine(), records,
+        owner = arguments.owner,
+        batch_size = arguments.batch_size,
+        rebuild_indexes = arguments.rebuild_indexes,
+        progress = printProgress
+    )
+
+    printProgress(loaded, seconds)
@@ -0,0 +1,155 @@
+import base64
+import json
+import os
+import socket
+import threading
+import time
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class StubOAuthServer(ThreadingMixIn, HTTPServer):
+    """A local stand-in for the Google OAuth endpoints, to test and benchmark logins against.
+
+    Every exchange of an authorization code issues a new access token 'token-<code>-<n>', which
+    belongs to the Google user <code>, named 'User <code>' with the email '<code>@example.com'.
+    Every response can be delayed to stand in for the round trip to Google.
+    """
+
+    daemon_threads = True
+
+    # Accept many logins at once without dropping connections
+    request_queue_size = 128
+
+    def __init__(self, client_id, latency=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubOAuthHandler)
+        self.client_id = client_id
+        self.latency = latency
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+        # Count the access tokens issued, the connections opened and the requests made to every
+        # endpoint
+        self.tokens = 0
+        self.connections = 0
+        self.requests = {}
+        self.lock = threading.Lock()
+
+        # Track the open connections, so they can be closed along with the server
+        self.sockets = set()
+
+    def start(self):
+        """Serve requests on a background thread."""
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving requests and close the listening socket."""
+
+        self.shutdown()
+        self.server_close()
+
+        with self.lock:
+            for open_socket in self.sockets:
+                open_socket.shutdown(socket.SHUT_RDWR)
+
+    def writeClientSecrets(self, directory):
+        """Write a client secrets file pointing at this server and return its path."""
+
+        path = os.path.join(directory, 'client_secret.json')
+
+        with open(path, 'w') as secrets:
+            json.dump({'web': {
+                'client_id': self.client_id,
+                'client_secret': 'secret',
+                'auth_uri': self.url + '/o/oauth2/auth',
+                'token_uri': self.url + '/o/oauth2/token',
+                'redirect_uris': [],
+                'javascript_origins': []
+            }}, secrets)
+
+        return path
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+            self.sockets.add(request)
+
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.sockets.discard(request)
+
+        HTTPServer.shutdown_request(self, request)
+
+
+class StubOAuthHandler(BaseHTTPRequestHandler):
+    """Answer requests to the token, token information, user information and revocation URLs."""
+
+    # Keep connections open between requests, the same way Google does, and send every response
+    # in one go rather than a write per header
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parameters = dict(urlparse.parse_qsl(url.query))
+        token = parameters.get('access_token') or parameters.get('token') or ''
+        user = token[len('token-'):].rsplit('-', 1)[0] if token.startswith('token-') else None
+
+        if user is None:
+            self.respond(url.path, 400, {'error': 'invalid_token'})
+        elif url.path == '/oauth2/v1/tokeninfo':
+            self.respond(url.path, 200, {
+                'user_id': user,
+                'issued_to': self.server.client_id,
+                'expires_in': 3600
+            })
+        elif url.path == '/oauth2/v1/userinfo':
+            self.respond(url.path, 200, {
+                'name': 'User %s' % user,
+                'email': '%s@example.com' % user
+            })
+        elif url.path == '/o/oauth2/revoke':
+            self.respond(url.path, 200, {})
+        else:
+            self.respond(url.path, 404, {'error': 'not_found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+        code = dict(urlparse.parse_qsl(body)).get('code')
+
+        # The id token is only decoded, never verified, so it needs no real signature
+        payload = base64.urlsafe_b64encode(json.dumps({'sub': code})).rstrip('=')
+
+        with self.server.lock:
+            self.server.tokens += 1
+            token = 'token-%s-%d' % (code, self.server.tokens)
+
+        self.respond(self.path, 200, {
+            'access_token': token,
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'id_token': 'header.%s.signature' % payload
+        })
+
+    def respond(self, path, status, data):
+        with self.server.lock:
+            self.server.requests[path] = self.server.requests.get(path, 0) + 1
+
+        time.sleep(self.server.latency)
+
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,104 @@
+import threading
+
+from collections import OrderedDict
+
+
+class PageCache(object):
+    """A size bounded, least recently used cache of rendered pages.
+
+    Every page is stored along with a set of tags naming the data it was built from, so a write
+    can evict exactly the pages it affects.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        # Map keys to (page, tags) in order of use, and tags to the keys stored under them
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+
+        # Pages are shared between request threads, so guard every change to the cache
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the page stored under the given key, or None if it is not cached."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Re-insert the entry to mark it as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+
+            return entry[0]
+
+    def set(self, key, page, tags):
+        """Store a page under the given key, tagged with the data it was built from."""
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (page, tags)
+
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+
+            # Drop the least recently used pages once the cache is over its size bound
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def evict(self, *tags):
+        """Remove every page stored under any of the given tags."""
+
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """Remove every page from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        """Return the size of the cache along with its hit, miss and eviction counters."""
+
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _remove(self, key):
+        """Remove a single page and its tags. The lock must already be held."""
+
+        entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        for tag in entry[1]:
+            keys = self._keys_by_tag.get(tag)
+            keys.discard(key)
+
+            if not keys:
+                del self._keys_by_tag[tag]
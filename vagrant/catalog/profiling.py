@@ -0,0 +1,262 @@
+import bisect
+import cProfile
+import os
+import random
+import tempfile
+import threading
+
+from flask import jsonify, abort, current_app, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from timeit import default_timer as timer
+from werkzeug.wsgi import ClosingIterator
+
+
+# The upper bounds of the histogram buckets, in milliseconds. Anything slower falls in a last one
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# The parts of a request that are timed, besides the request as a whole
+PARTS = ('sql', 'template', 'session')
+
+
+class Histogram(object):
+    """A count of durations per bucket, along with their total."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def add(self, seconds):
+        """Count a duration in the bucket it falls in."""
+
+        milliseconds = seconds * 1e3
+        self.counts[bisect.bisect_left(BUCKETS, milliseconds)] += 1
+        self.total += milliseconds
+
+    def serialize(self):
+        """Return the histogram in a form that can be turned into JSON."""
+
+        count = sum(self.counts)
+
+        return {
+            'count': count,
+            'total_ms': self.total,
+            'mean_ms': self.total / count if count else 0,
+            'buckets': [{'le_ms': bound, 'count': bucket_count}
+                for bound, bucket_count in zip(BUCKETS + ('+Inf',), self.counts)]
+        }
+
+
+class RequestProfiler(object):
+    """Records where the time of every request goes, by the endpoint that handled it.
+
+    Each request is timed as a whole, along with the SQL queries it makes, the templates it renders
+    and the loading and saving of its session. The records are summed up into histograms per
+    endpoint, which are served as JSON at /admin/profile.json when the ADMIN_ENDPOINTS setting of
+    the app is on. A sample of the requests can also be run under cProfile, with their profiles
+    written to a directory to inspect with pstats.
+
+    Profiling is off until enabled, and costs next to nothing while it is off.
+
+    Args:
+      app: the Flask app to profile.
+      enabled: whether to profile requests from the start.
+      sample_rate: the fraction of requests to run under cProfile.
+      directory: the directory cProfile output is written to.
+    """
+
+    def __init__(self, app, enabled=False, sample_rate=0, directory='profiles'):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+        # Wrap the app so even the loading and saving of sessions fall within the timed request
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+        app.session_interface = TimedSessionInterface(app.session_interface)
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self.recordEndpoint)
+        app.add_url_rule('/admin/profile.json', 'profileJSON', self.profileJSON)
+
+        # Time the queries of every engine, including those created after the profiler
+        event.listen(Engine, 'before_cursor_execute', startQuery)
+        event.listen(Engine, 'after_cursor_execute', finishQuery)
+        event.listen(Engine, 'handle_error', abandonQuery)
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.wsgi_app(environ, start_response)
+
+        record = environ['catalog.profile'] = {
+            'start': timer(), 'endpoint': None, 'queries': 0, 'sql': 0.0, 'template': 0.0,
+            'session': 0.0}
+
+        if random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            profile.enable()
+
+            try:
+                response = self.wsgi_app(environ, start_response)
+            finally:
+                profile.disable()
+                self.dumpProfile(profile, record)
+        else:
+            response = self.wsgi_app(environ, start_response)
+
+        # Record the request once its response is sent, streamed or not
+        return ClosingIterator(response, lambda: self.addRecord(record))
+
+    def recordEndpoint(self):
+        """Tag the profile of the current request with its endpoint."""
+
+        record = request.environ.get('catalog.profile')
+
+        if record is not None:
+            record['endpoint'] = request.endpoint
+
+    def addRecord(self, record):
+        """Sum up the profile of a finished request into the histograms of its endpoint."""
+
+        wall = timer() - record['start']
+
+        with self._lock:
+            endpoint = self._endpoints.get(record['endpoint'])
+
+            if endpoint is None:
+                endpoint = self._endpoints[record['endpoint']] = {
+                    'requests': 0, 'queries': 0, 'wall': Histogram()}
+                endpoint.update((part, Histogram()) for part in PARTS)
+
+            endpoint['requests'] += 1
+            endpoint['queries'] += record['queries']
+            endpoint['wall'].add(wall)
+
+            for part in PARTS:
+                endpoint[part].add(record[part])
+
+    def dumpProfile(self, profile, record):
+        """Write the cProfile output of a sampled request to the profile directory."""
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        descriptor, path = tempfile.mkstemp(prefix='%s-' % (record['endpoint'] or 'unknown'),
+            suffix='.prof', dir=self.directory)
+        os.close(descriptor)
+        profile.dump_stats(path)
+
+    def stats(self):
+        """Return the histograms of every endpoint in a form that can be turned into JSON."""
+
+        with self._lock:
+            return dict((name or 'unknown', {
+                'requests': endpoint['requests'],
+                'queries': endpoint['queries'],
+                'queries_per_request': float(endpoint['queries']) / endpoint['requests'],
+                'wall': endpoint['wall'].serialize(),
+                'sql': endpoint['sql'].serialize(),
+                'template': endpoint['template'].serialize(),
+                'session': endpoint['session'].serialize()
+            }) for name, endpoint in self._endpoints.iteritems())
+
+    def clear(self):
+        """Throw away every record so far."""
+
+        with self._lock:
+            self._endpoints.clear()
+
+    def profileJSON(self):
+        """Return the request histograms of every endpoint."""
+
+        if not self.enabled or not current_app.config.get('ADMIN_ENDPOINTS'):
+            abort(404)
+
+        return jsonify(self.stats())
+
+
+class TimedTemplate(Template):
+    """A template which adds the time it takes to render to the profile of the current request."""
+
+    def render(self, *args, **kwargs):
+        start = timer()
+
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            addTime('template', timer() - start)
+
+
+class TimedSessionInterface(object):
+    """Wraps a session interface to add the time taken by sessions to the current profile."""
+
+    def __init__(self, session_interface):
+        self.session_interface = session_interface
+
+    def open_session(self, app, request):
+        start = timer()
+
+        try:
+            return self.session_interface.open_session(app, request)
+        finally:
+            addTime('session', timer() - start)
+
+    def save_session(self, app, session, response):
+        start = timer()
+
+        try:
+            return self.session_interface.save_session(app, session, response)
+        finally:
+            addTime('session', timer() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.session_interface, name)
+
+
+def currentRecord():
+    """Return the profile of the current request, or None if it is not being profiled."""
+
+    if not has_request_context():
+        return None
+
+    return request.environ.get('catalog.profile')
+
+
+def addTime(part, seconds):
+    """Add the time taken by a part of the current request to its profile."""
+
+    record = currentRecord()
+
+    if record is not None:
+        record[part] += seconds
+
+
+def startQuery(connection, cursor, statement, parameters, context, executemany):
+    """Note the time a query starts at."""
+
+    connection.info.setdefault('query_start', []).append(timer())
+
+
+def finishQuery(connection, cursor, statement, parameters, context, executemany):
+    """Add a finished query and the time it took to the profile of the current request."""
+
+    seconds = timer() - connection.info['query_start'].pop()
+    record = currentRecord()
+
+    if record is not None:
+        record['queries'] += 1
+        record['sql'] += seconds
+
+
+def abandonQuery(exception_context):
+    """Forget the start time of a query that failed."""
+
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get('query_start')
+
+        if starts:
+            starts.pop()
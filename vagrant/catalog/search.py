@@ -0,0 +1,328 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+
+from collections import defaultdict
+from database_setup import Item
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+
+# Queries and documents are broken into lowercase words, and every query word matches any indexed
+# word it is a prefix of. Matches in the name of an item rank above matches in its description.
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    """Break a piece of text into lowercase words."""
+
+    return re.findall(r'\w+', (text or '').lower(), re.UNICODE)
+
+
+def createSearchIndex(engine):
+    """Set up and return the best search index the given database supports.
+
+    SQLite databases use an FTS5 table and PostgreSQL databases use a GIN index over a tsvector.
+    Anything else, including SQLite builds without FTS5, falls back to an in-process index.
+    """
+
+    if engine.dialect.name == 'postgresql':
+        return PostgreSQLSearchIndex(engine)
+
+    if engine.dialect.name == 'sqlite':
+        try:
+            return SQLiteSearchIndex(engine)
+        except OperationalError:
+            pass
+
+    return InvertedIndex(engine)
+
+
+def applyChanges(session):
+    """Apply the changes queued for in-process indexes by a session which has just committed."""
+
+    for index, changes in session.info.pop('search_changes', {}).iteritems():
+        index.apply(changes)
+
+
+def discardChanges(session):
+    """Forget the changes queued for in-process indexes by a session which has just rolled back."""
+
+    session.info.pop('search_changes', None)
+
+
+class SQLiteSearchIndex(object):
+    """A search index kept in an SQLite FTS5 table, ranked by BM25."""
+
+    def __init__(self, engine):
+        with engine.begin() as connection:
+            exists = connection.execute(text(
+                "select count(*) from sqlite_master where name = 'item_search'")).scalar()
+
+            # Index the existing items when the table is first created
+            if not exists:
+                connection.execute(
+                    'create virtual table item_search using fts5(name, description)')
+                self.addItems(connection)
+
+    def add(self, connection, item):
+        """Add an item to the index as part of the current transaction."""
+
+        connection.execute(text(
+            'insert into item_search (rowid, name, description) '
+            'values (:id, :name, :description)'),
+            {'id': item.id, 'name': item.name, 'description': item.description})
+
+    def update(self, connection, item):
+        """Reindex an edited item as part of the current transaction."""
+
+        self.remove(connection, item)
+        self.add(connection, item)
+
+    def remove(self, connection, item):
+        """Remove an item from the index as part of the current transaction."""
+
+        connection.execute(text('delete from item_search where rowid = :id'), {'id': item.id})
+
+    def addItems(self, connection, after_id=0):
+        """Add every item with an id greater than the given one, such as a bulk loaded batch."""
+
+        connection.execute(text(
+            'insert into item_search (rowid, name, description) '
+            'select id, name, description from item where id > :id'), {'id': after_id})
+
+    def search(self, connection, query, limit):
+        """Return the ids of the items best matching the query, best match first."""
+
+        words = tokenize(query)
+
+        if not words:
+            return []
+
+        # Quote every word so it is never read as FTS5 syntax, and match it as a prefix
+        match = ' '.join('"%s"*' % word for word in words)
+        rank = 'bm25(item_search, %d, %d)' % (NAME_WEIGHT, DESCRIPTION_WEIGHT)
+
+        return [row[0] for row in connection.execute(text(
+            'select rowid from item_search where item_search match :match '
+            'order by %s limit :limit' % rank), {'match': match, 'limit': limit})]
+
+    def drop(self, connection):
+        """Remove the index from the database."""
+
+        connection.execute('drop table if exists item_search')
+
+
+class PostgreSQLSearchIndex(object):
+    """A search index kept in a PostgreSQL GIN index over a weighted tsvector, ranked by ts_rank.
+
+    PostgreSQL keeps the index up to date by itself as items are written.
+    """
+
+    DOCUMENT = ("setweight(to_tsvector('simple', name), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'B')")
+
+    def __init__(self, engine):
+        engine.execute('create index if not exists ix_item_search on item using gin ((%s))' % (
+            self.DOCUMENT))
+
+    def add(self, connection, item):
+        """Add an item to the index. PostgreSQL already does so as the item is written."""
+
+    def update(self, connection, item):
+        """Reindex an edited item. PostgreSQL already does so as the item is written."""
+
+    def remove(self, connection, item):
+        """Remove an item from the index. PostgreSQL already does so as the item is deleted."""
+
+    def addItems(self, connection, after_id=0):
+        """Add bulk loaded items to the index. PostgreSQL already does so as they are written."""
+
+    def search(self, connection, query, limit):
+        """Return the ids of the items best matching the query, best match first."""
+
+        words = tokenize(query)
+
+        if not words:
+            return []
+
+        # Words only ever hold word characters, so they never clash with the tsquery syntax
+        match = ' & '.join('%s:*' % word for word in words)
+        weights = "'{0, 0, %d, %d}'" % (DESCRIPTION_WEIGHT, NAME_WEIGHT)
+
+        return [row[0] for row in connection.execute(text(
+            "select id from item where %s @@ to_tsquery('simple', :match) "
+            "order by ts_rank(%s, %s, to_tsquery('simple', :match)) desc, id limit :limit" % (
+                self.DOCUMENT, weights, self.DOCUMENT)), {'match': match, 'limit': limit})]
+
+    def drop(self, connection):
+        """Remove the index from the database."""
+
+        connection.execute('drop index if exists ix_item_search')
+
+
+class InvertedIndex(object):
+    """An in-process inverted index, ranked by TF-IDF.
+
+    The index is built from the database on first use and lives in the memory of the process, so
+    it only sees the writes made through that process. It suits single process deployments, and
+    databases which have no full text search of their own.
+
+    The memory of the process cannot be rolled back along with a transaction, so the items added,
+    updated and removed in a session are only applied to the index by applyChanges once the
+    session commits, and thrown away by discardChanges if it rolls back.
+    """
+
+    def __init__(self, engine):
+        self._lock = threading.Lock()
+        self._postings = None
+
+    def add(self, connection, item):
+        """Add an item to the index once the session commits."""
+
+        self._queue(connection, item.id, (item.name, item.description))
+
+    def update(self, connection, item):
+        """Reindex an edited item once the session commits."""
+
+        self._queue(connection, item.id, (item.name, item.description))
+
+    def remove(self, connection, item):
+        """Remove an item from the index once the session commits."""
+
+        self._queue(connection, item.id, None)
+
+    def apply(self, changes):
+        """Apply committed changes, each an item id and its name and description or None."""
+
+        with self._lock:
+            if self._postings is not None:
+                for id, document in changes:
+                    self._remove(id)
+
+                    if document is not None:
+                        self._add(id, *document)
+
+    def addItems(self, connection, after_id=0):
+        """Add every item with an id greater than the given one, such as a bulk loaded batch."""
+
+        with self._lock:
+            if self._postings is not None:
+                self._load(connection, after_id)
+
+    def search(self, connection, query, limit):
+        """Return the ids of the items best matching the query, best match first."""
+
+        words = tokenize(query)
+
+        if not words:
+            return []
+
+        with self._lock:
+            if self._postings is None:
+                self._postings = {}
+                self._words = []
+                self._new_words = set()
+                self._documents = {}
+                self._load(connection)
+
+            self._sortWords()
+            scores = None
+
+            for word in words:
+                word_scores = defaultdict(float)
+
+                # Score every item holding an indexed word the query word is a prefix of, weighing
+                # rare words above common ones
+                start = bisect.bisect_left(self._words, word)
+
+                for indexed_word in self._words[start:]:
+                    if not indexed_word.startswith(word):
+                        break
+
+                    # Words whose every item was removed stay in the list until it is next sorted
+                    postings = self._postings.get(indexed_word)
+
+                    if postings is None:
+                        continue
+
+                    weight = math.log(1.0 + float(len(self._documents)) / len(postings))
+
+                    for id, count in postings.iteritems():
+                        word_scores[id] += weight * count
+
+                # Only keep the items matching every word of the query
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = dict((id, score + word_scores[id])
+                        for id, score in scores.iteritems() if id in word_scores)
+
+            return heapq.nlargest(limit, scores, key=lambda id: (scores[id], -id))
+
+    def drop(self, connection):
+        """Throw the index away, to be rebuilt on next use."""
+
+        with self._lock:
+            self._postings = None
+
+    def _queue(self, session, id, document):
+        """Queue a change to an item in the session, to be applied once the session commits."""
+
+        session.info.setdefault('search_changes', {}).setdefault(self, []).append((id, document))
+
+    def _load(self, connection, after_id=0):
+        """Index every item with an id greater than the given one. The lock must be held."""
+
+        rows = connection.execute(select([Item.id, Item.name, Item.description]).where(
+            Item.id > after_id))
+
+        for id, name, description in rows:
+            self._add(id, name, description)
+
+    def _add(self, id, name, description):
+        """Add a single item to the index. The lock must be held."""
+
+        # Count an occurrence of every word per unit of weight, so the count is the term weight
+        words = tokenize(name) * NAME_WEIGHT + tokenize(description) * DESCRIPTION_WEIGHT
+
+        for word in words:
+            postings = self._postings.get(word)
+
+            if postings is None:
+                postings = self._postings[word] = {}
+
+                # New words are sorted into the word list in one go by the next search, rather
+                # than inserted one at a time
+                index = bisect.bisect_left(self._words, word)
+
+                if index == len(self._words) or self._words[index] != word:
+                    self._new_words.add(word)
+
+            postings[id] = postings.get(id, 0) + 1
+
+        self._documents[id] = tuple(set(words))
+
+    def _remove(self, id):
+        """Remove a single item from the index. The lock must be held."""
+
+        for word in self._documents.pop(id, ()):
+            postings = self._postings[word]
+            del postings[id]
+
+            if not postings:
+                del self._postings[word]
+
+    def _sortWords(self):
+        """Merge the new words into the sorted list of words. The lock must be held."""
+
+        if not self._new_words:
+            return
+
+        # Both lists are sorted already, so sorting them together merges them in linear time
+        self._words = sorted([word for word in self._words if word in self._postings] +
+            sorted(self._new_words))
+        self._new_words = set()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# serve.py -- serve the catalog app
+#
+# The app can be served in one of two modes, with the same routes and templates:
+#   threaded: Flask's development server, which blocks a thread per request, as application.py
+#     does when it is run directly.
+#   gevent: gevent's WSGI server, which runs every request in a greenlet. Waiting on Google during
+#     login, or on PostgreSQL when psycogreen is installed, yields to the other requests rather
+#     than blocking a thread. Needs gevent to be installed.
+#
+#     $ python serve.py --mode gevent --port 8000
+#
+
+import argparse
+
+
+def serveThreaded(host, port):
+    """Serve the app with Flask's threaded development server."""
+
+    from application import createApp
+
+    app = createApp(warm=True)
+    app.secret_key = app.secret_key or 'guess_this'
+    app.run(host=host, port=port, threaded=True)
+
+
+def serveGevent(host, port, connections):
+    """Serve the app with gevent, handling up to the given number of connections at once."""
+
+    # Make sockets, locks and thread locals cooperative before anything else creates them, so
+    # requests to Google, the connection pool and the per-request sessions all yield instead of
+    # blocking
+    from gevent import monkey
+    monkey.patch_all()
+
+    # The psycopg2 driver talks to PostgreSQL in C, out of reach of monkey patching, so it needs
+    # its own wait callback to yield while a query runs
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+    from application import createApp
+    from gevent.pywsgi import WSGIServer
+
+    app = createApp(warm=True)
+    app.secret_key = app.secret_key or 'guess_this'
+    WSGIServer((host, port), app, spawn=connections, log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the catalog app.')
+    parser.add_argument('--mode', choices=['threaded', 'gevent'], default='threaded',
+        help='serve a thread or a greenlet per request')
+    parser.add_argument('--host', default='0.0.0.0', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='the port to listen on')
+    parser.add_argument('--connections', type=int, default=1000,
+        help='the maximum number of connections handled at once in gevent mode')
+
+    arguments = parser.parse_args()
+
+    if arguments.mode == 'gevent':
+        serveGevent(arguments.host, arguments.port, arguments.connections)
+    else:
+        serveThreaded(arguments.host, arguments.port)
@@ -0,0 +1,351 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+# Session ids are 128 random bits, so they cannot be guessed and need no signature
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{22}$')
+
+
+def createSessionStore(backend, path=None, max_size=10000):
+    """Return a session store for the given backend.
+
+    Args:
+      backend: 'memory', 'sqlite' or 'file'.
+      path: the SQLite database or the directory to keep sessions in.
+      max_size: the number of sessions kept by the memory backend.
+    """
+
+    if backend == 'memory':
+        return MemorySessionStore(max_size)
+
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path or 'sessions.db')
+
+    if backend == 'file':
+        return FileSessionStore(path or 'sessions')
+
+    raise ValueError('Unknown session backend %s' % backend)
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """A session whose data is kept on the server, under the id in its cookie."""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def onUpdate(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, onUpdate)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+
+        # The user the session was opened for, so a log in or out can be told apart on save
+        self.opened_user_id = self.get('user_id')
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a store on the server, and only a short session id in the cookie.
+
+    The cookie is a fraction of the size of a signed one and needs no signature checked on every
+    request, and a session can be revoked on the server. A session is written back only when it
+    changes or is halfway to expiring, and expired sessions are cleared out in batches.
+
+    Args:
+      store: where the sessions are kept, as returned by createSessionStore.
+      ttl: the number of seconds a session lasts after it was last written.
+      cleanup_interval: the number of seconds between clearing out expired sessions.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl=86400, cleanup_interval=300):
+        self.store = store
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+
+        self._last_cleanup = time.time()
+        self._cleanup_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+
+        # Static files never touch the session, so do not look it up for them
+        if request.endpoint == 'static':
+            return ServerSideSession(sid=sid)
+
+        if sid is not None and SESSION_ID.match(sid):
+            stored = self.store.get(sid)
+
+            if stored is not None:
+                return ServerSideSession(self.serializer.loads(stored[0]), sid, stored[1])
+
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        # Forget emptied sessions, such as after logging out
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+
+            return
+
+        if not session.modified and session.expires - now > self.ttl / 2.0:
+            return
+
+        # Give the session a new id whenever its user changes, so an id planted in a browser before
+        # logging in cannot be used to ride on the logged in session
+        if session.sid is not None and session.get('user_id') != session.opened_user_id:
+            self.store.delete(session.sid)
+            session.sid = None
+
+        if session.sid is None:
+            session.sid = base64.urlsafe_b64encode(os.urandom(16)).rstrip('=')
+
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), now + self.ttl,
+            session.get('user_id'))
+
+        response.set_cookie(app.session_cookie_name, session.sid,
+            expires = self.get_expiration_time(app, session),
+            httponly = self.get_cookie_httponly(app),
+            domain = domain,
+            path = path,
+            secure = self.get_cookie_secure(app),
+            samesite = self.get_cookie_samesite(app)
+        )
+
+        self.cleanup(now)
+
+    def cleanup(self, now=None):
+        """Remove the expired sessions from the store, if that was last done long enough ago."""
+
+        now = now or time.time()
+
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+
+        # Only one thread clears the store at a time, the rest carry on with their requests
+        if self._cleanup_lock.acquire(False):
+            try:
+                self._last_cleanup = now
+                self.store.cleanup(now)
+            finally:
+                self._cleanup_lock.release()
+
+    def revoke(self, user_id):
+        """End every session of the given user, logging them out everywhere."""
+
+        self.store.revoke(user_id)
+
+
+class MemorySessionStore(object):
+    """Keeps sessions in the memory of the process, dropping the least recently used ones.
+
+    Sessions are lost on restart and not shared between processes, so this suits single process
+    deployments and tests.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        """Return the data and expiry time of an unexpired session, or None."""
+
+        with self._lock:
+            stored = self._sessions.pop(sid, None)
+
+            if stored is None or stored[1] <= time.time():
+                return None
+
+            # Re-insert the session to mark it as the most recently used
+            self._sessions[sid] = stored
+
+            return stored[:2]
+
+    def set(self, sid, data, expires, user_id):
+        """Store the data of a session until the given time."""
+
+        with self._lock:
+            self._sessions.pop(sid, None)
+            self._sessions[sid] = (data, expires, user_id)
+
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        """Remove a session."""
+
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def revoke(self, user_id):
+        """Remove every session of the given user."""
+
+        with self._lock:
+            for sid in [sid for sid, stored in self._sessions.iteritems() if stored[2] == user_id]:
+                del self._sessions[sid]
+
+    def cleanup(self, now):
+        """Remove every session which expired before the given time."""
+
+        with self._lock:
+            for sid in [sid for sid, stored in self._sessions.iteritems() if stored[1] <= now]:
+                del self._sessions[sid]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(object):
+    """Keeps sessions in an SQLite database, shared by every process on the machine."""
+
+    def __init__(self, path):
+        self.path = path
+
+        # SQLite connections cannot be shared between threads, so each opens its own on first use
+        self._local = threading.local()
+
+    def get(self, sid):
+        """Return the data and expiry time of an unexpired session, or None."""
+
+        return self._connect().execute('select data, expires from session '
+            'where id = ? and expires > ?', (sid, time.time())).fetchone()
+
+    def set(self, sid, data, expires, user_id):
+        """Store the data of a session until the given time."""
+
+        self._connect().execute('insert or replace into session (id, data, expires, user_id) '
+            'values (?, ?, ?, ?)', (sid, data, expires, user_id))
+
+    def delete(self, sid):
+        """Remove a session."""
+
+        self._connect().execute('delete from session where id = ?', (sid,))
+
+    def revoke(self, user_id):
+        """Remove every session of the given user."""
+
+        self._connect().execute('delete from session where user_id = ?', (user_id,))
+
+    def cleanup(self, now):
+        """Remove every session which expired before the given time."""
+
+        self._connect().execute('delete from session where expires <= ?', (now,))
+
+    def __len__(self):
+        return self._connect().execute('select count(*) from session').fetchone()[0]
+
+    def _connect(self):
+        """Return the connection of the current thread, opening it on first use."""
+
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            # Commit every statement as it runs, and let reads carry on while another process
+            # writes
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('pragma journal_mode = wal')
+            connection.execute('create table if not exists session (id text primary key, '
+                'data text not null, expires real not null, user_id integer)')
+            connection.execute('create index if not exists ix_session_expires '
+                'on session (expires)')
+            connection.execute('create index if not exists ix_session_user_id '
+                'on session (user_id)')
+            self._local.connection = connection
+
+        return connection
+
+
+class FileSessionStore(object):
+    """Keeps every session in a file of its own, in a directory shared by every process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, sid):
+        """Return the data and expiry time of an unexpired session, or None."""
+
+        stored = self._read(os.path.join(self.directory, sid))
+
+        if stored is None or stored['expires'] <= time.time():
+            return None
+
+        return stored['data'], stored['expires']
+
+    def set(self, sid, data, expires, user_id):
+        """Store the data of a session until the given time."""
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Write to a temporary file and move it into place, so readers never see half a session
+        descriptor, path = tempfile.mkstemp(dir=self.directory, prefix='.')
+
+        with os.fdopen(descriptor, 'w') as session_file:
+            json.dump({'data': data, 'expires': expires, 'user_id': user_id}, session_file)
+
+        os.rename(path, os.path.join(self.directory, sid))
+
+    def delete(self, sid):
+        """Remove a session."""
+
+        try:
+            os.remove(os.path.join(self.directory, sid))
+        except OSError:
+            pass
+
+    def revoke(self, user_id):
+        """Remove every session of the given user."""
+
+        self._removeWhere(lambda stored: stored['user_id'] == user_id)
+
+    def cleanup(self, now):
+        """Remove every session which expired before the given time."""
+
+        self._removeWhere(lambda stored: stored['expires'] <= now)
+
+    def __len__(self):
+        return len(self._sids())
+
+    def _sids(self):
+        """Return the ids of every stored session."""
+
+        if not os.path.isdir(self.directory):
+            return []
+
+        return [sid for sid in os.listdir(self.directory) if not sid.startswith('.')]
+
+    def _removeWhere(self, condition):
+        """Remove every session whose stored data meets the given condition."""
+
+        for sid in self._sids():
+            stored = self._read(os.path.join(self.directory, sid))
+
+            if stored is not None and condition(stored):
+                self.delete(sid)
+
+    def _read(self, path):
+        """Return the stored data in a session file, or None if there is no such file."""
+
+        try:
+            with open(path) as session_file:
+                return json.load(session_file)
+        except (IOError, ValueError):
+            return None
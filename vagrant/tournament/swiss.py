@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# swiss.py -- pairing engine for a Swiss-system tournament
+#
+# Players are ranked by their wins and paired off down the standings, each with
+# the nearest player below them they have not played yet, so players meet others
+# with the same score and the odd one out of a score group floats down to the
+# next. When the last few players have all played each other, the pairings
+# around them are searched again for a set without rematches.
+#
+
+from bisect import bisect_left
+
+
+# how far down the waiting players the first pass looks for an opponent
+WINDOW = 64
+
+# the most players whose pairings are searched again when the first pass gets
+# stuck, and the most partial pairings tried while doing so
+REPAIR_SIZE = 256
+SEARCH_LIMIT = 100000
+
+
+def pairKey(one, two):
+    """Returns the key a pair of players is kept under in the set of played pairs."""
+    return (one, two) if one < two else (two, one)
+
+
+def pairPlayers(standings, played=(), byes=()):
+    """Pairs every player for the next round.
+
+    Args:
+      standings: a list of (id, wins) tuples, one for every player.
+      played: a set of the pairs of players who have already played each other,
+        each kept under pairKey.
+      byes: a set of the ids of the players who have already had a bye.
+
+    Returns:
+      A list of (id1, id2) tuples in the order of the standings. If the number of
+      players is odd, the last tuple is (id, None) for the player given a bye,
+      which is the lowest ranked player who has not had one yet.
+    """
+    # rank the players by wins, and by id within a score group so the pairings
+    # are the same every time for the same standings
+    players = [player for player, wins in sorted(standings, key=lambda row: (-row[1], row[0]))]
+
+    bye = None
+
+    if len(players) % 2:
+        # every player may have had a bye already, in which case the lowest
+        # ranked player gets another
+        index = next((index for index in xrange(len(players) - 1, -1, -1)
+            if players[index] not in byes), len(players) - 1)
+
+        bye = players.pop(index)
+
+    # pair every player with the highest ranked player still waiting for an
+    # opponent who they have not played yet
+    pairs = list()
+    waiting = list()
+
+    for player in players:
+        for index in xrange(min(len(waiting), WINDOW)):
+            if pairKey(waiting[index], player) not in played:
+                pairs.append((waiting.pop(index), player))
+                break
+        else:
+            waiting.append(player)
+
+    if waiting:
+        pairs = repairPairings(players, pairs, waiting, played)
+
+    if bye is not None:
+        pairs.append((bye, None))
+
+    return pairs
+
+
+def repairPairings(players, pairs, waiting, played):
+    """Pairs the players left waiting by searching the pairings around them again.
+
+    The pairings of the players ranked closest to those left waiting are taken
+    apart and searched for a set without rematches, taking in more and more of
+    the standings until one is found. If none is found within REPAIR_SIZE players
+    or SEARCH_LIMIT steps, the players left waiting are paired in order of rank,
+    rematches and all.
+
+    Returns:
+      The pairs of every player, in order of rank.
+    """
+    rank = dict((player, index) for index, player in enumerate(players))
+    waiting_ranks = sorted(rank[player] for player in waiting)
+
+    def distance(player):
+        """Returns how far a player is ranked from the nearest player left waiting."""
+        index = bisect_left(waiting_ranks, rank[player])
+
+        return min(abs(rank[player] - waiting_ranks[i])
+            for i in (index - 1, index) if 0 <= i < len(waiting_ranks))
+
+    radius = 1
+
+    while True:
+        kept = [pair for pair in pairs
+            if min(distance(pair[0]), distance(pair[1])) > radius]
+        region = sorted(set(players) - set(player for pair in kept for player in pair),
+            key=rank.get)
+
+        if len(region) > REPAIR_SIZE:
+            break
+
+        found = searchPairings(region, played)
+
+        if found is not None:
+            return sorted(kept + found, key=lambda pair: rank[pair[0]])
+
+        if len(region) == len(players):
+            break
+
+        radius *= 2
+
+    waiting = sorted(waiting, key=rank.get)
+
+    return sorted(pairs + zip(waiting[0::2], waiting[1::2]), key=lambda pair: rank[pair[0]])
+
+
+def searchPairings(players, played):
+    """Returns pairs of the given players without rematches, or None if there are none.
+
+    The highest ranked player is paired with the nearest player they can be, and
+    the rest searched in turn, backtracking when they cannot all be paired. Gives
+    up and returns None after SEARCH_LIMIT steps.
+    """
+    pairs = list()
+    steps = [0]
+
+    def search(remaining):
+        if not remaining:
+            return True
+
+        first = remaining[0]
+
+        for index in xrange(1, len(remaining)):
+            steps[0] += 1
+
+            if steps[0] > SEARCH_LIMIT:
+                return False
+
+            if pairKey(first, remaining[index]) not in played:
+                pairs.append((first, remaining[index]))
+
+                if search(remaining[1:index] + remaining[index + 1:]):
+                    return True
+
+                pairs.pop()
+
+        return False
+
+    if search(players):
+        return pairs
+
+    return None
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Test cases for swiss.py
+# The pairing engine needs no database, so these tests play out random
+# tournaments in memory and check properties every round's pairings must have.
+
+import random
+
+from swiss import pairKey, pairPlayers
+
+
+def playRound(wins, played, byes, pairs):
+    """Plays out a round of pairings, picking the winner of every match at random."""
+    for (one, two) in pairs:
+        if two is None:
+            byes.add(one)
+            wins[one] += 1
+        else:
+            played.add(pairKey(one, two))
+            wins[random.choice((one, two))] += 1
+
+
+def canPairWithoutRematches(players, played):
+    """Returns whether the players can all be paired without a rematch, trying every way."""
+    if not players:
+        return True
+    return any(pairKey(players[0], other) not in played and
+               canPairWithoutRematches([p for p in players[1:] if p != other], played)
+               for other in players[1:])
+
+
+def testEveryPlayerPairedOnce():
+    """
+    Test that every player appears exactly once in every round, with a bye only for odd counts.
+    """
+    random.seed(1)
+    for count in xrange(1, 41):
+        wins = dict((player, 0) for player in xrange(count))
+        played = set()
+        byes = set()
+        for round in xrange(6):
+            pairs = pairPlayers(wins.items(), played, byes)
+            players = [player for pair in pairs for player in pair if player is not None]
+            if sorted(players) != range(count):
+                raise ValueError(
+                    "Every player should be paired once. Got {p}".format(p=pairs))
+            if len([pair for pair in pairs if pair[1] is None]) != count % 2:
+                raise ValueError("Only an odd number of players should get a bye.")
+            playRound(wins, played, byes, pairs)
+    print "1. Every player is paired exactly once per round, with a bye only for odd counts."
+
+
+def testByes():
+    """
+    Test that byes go to the lowest ranked player who has not had one.
+    """
+    random.seed(2)
+    for count in (3, 5, 9, 15):
+        wins = dict((player, 0) for player in xrange(count))
+        played = set()
+        byes = set()
+        for round in xrange(count):
+            pairs = pairPlayers(wins.items(), played, byes)
+            bye = pairs[-1][0]
+            if pairs[-1][1] is not None or bye in byes:
+                raise ValueError("No player should get a second bye before everyone had one.")
+            ranked = sorted(wins.items(), key=lambda row: (-row[1], row[0]))
+            eligible = [player for player, w in ranked if player not in byes]
+            if bye != eligible[-1]:
+                raise ValueError("The bye should go to the lowest ranked player without one.")
+            playRound(wins, played, byes, pairs)
+    print "2. Byes go to the lowest ranked player without one, one per player."
+
+
+def testNoRematches():
+    """
+    Test that no players meet twice whenever every player can be paired without a rematch.
+    """
+    random.seed(3)
+    for trial in xrange(300):
+        count = random.choice((4, 6, 8, 10))
+        wins = dict((player, 0) for player in xrange(count))
+        played = set()
+        byes = set()
+        for round in xrange(count - 1):
+            pairs = pairPlayers(wins.items(), played, byes)
+            possible = canPairWithoutRematches(range(count), played)
+            rematches = [pair for pair in pairs if pairKey(*pair) in played]
+            if possible and rematches:
+                raise ValueError("Players should not meet twice. Got {r}".format(r=rematches))
+            playRound(wins, played, byes, pairs)
+    wins = dict((player, 0) for player in xrange(10000))
+    played = set()
+    for round in xrange(12):
+        pairs = pairPlayers(wins.items(), played)
+        if any(pairKey(*pair) in played for pair in pairs):
+            raise ValueError("Players of a large tournament should not meet twice.")
+        playRound(wins, played, set(), pairs)
+    print "3. Players never meet twice when it can be avoided."
+
+
+def testScoreGroups():
+    """
+    Test that players are paired within their score group, floating the odd one down.
+    """
+    random.seed(4)
+    for trial in xrange(100):
+        count = random.randrange(2, 60, 2)
+        standings = [(player, random.randrange(4)) for player in xrange(count)]
+        ranked = [player for player, w in sorted(standings, key=lambda row: (-row[1], row[0]))]
+        pairs = pairPlayers(standings)
+        if pairs != zip(ranked[0::2], ranked[1::2]):
+            raise ValueError("Without past matches, players next to each other should be paired.")
+    wins = dict((player, 0) for player in xrange(64))
+    played = set()
+    for round in xrange(6):
+        pairs = pairPlayers(wins.items(), played)
+        for (one, two) in pairs:
+            if abs(wins[one] - wins[two]) > 1:
+                raise ValueError("Paired players should be no more than one win apart.")
+        played.update(pairKey(*pair) for pair in pairs)
+        for (one, two) in pairs:
+            wins[min(one, two)] += 1
+    print "4. Players are paired within their score group, floating the odd one down."
+
+
+def testDeterministic():
+    """
+    Test that the same standings and history always give the same pairings.
+    """
+    random.seed(5)
+    wins = dict((player, random.randrange(5)) for player in xrange(101))
+    played = set(pairKey(*random.sample(xrange(101), 2)) for i in xrange(300))
+    byes = set(random.sample(xrange(101), 20))
+    pairs = pairPlayers(wins.items(), played, byes)
+    for trial in xrange(10):
+        standings = wins.items()
+        random.shuffle(standings)
+        if pairPlayers(standings, played, byes) != pairs:
+            raise ValueError("Pairings should not depend on the order of the standings.")
+    print "5. The same standings and history always give the same pairings."
+
+
+if __name__ == '__main__':
+    testEveryPlayerPairedOnce()
+    testByes()
+    testNoRematches()
+    testScoreGroups()
+    testDeterministic()
+    print "Success!  All tests pass!"
@@ -3,73 +3,186 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import logging
+import os
+import threading
+
 import psycopg2
 
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from swiss import pairKey, pairPlayers
+
+
+# the database to connect to and how many connections to keep open, configured from the
+# environment. the pool closes any connection handed back while it already keeps the minimum
+# open, so the minimum defaults to the maximum to keep every connection open under load
+DSN = os.environ.get("TOURNAMENT_DSN", "dbname=tournament")
+POOL_MAX_SIZE = int(os.environ.get("TOURNAMENT_POOL_MAX_SIZE", 10))
+POOL_MIN_SIZE = int(os.environ.get("TOURNAMENT_POOL_MIN_SIZE", POOL_MAX_SIZE))
+
+# the number of rows inserted per statement by the bulk functions
+BATCH_SIZE = 1000
+
+log = logging.getLogger(__name__)
+
+# the pool is opened on first use, so importing this module does not connect.
+# threads wait for a free connection once every one is in use
+pool = None
+pool_lock = threading.Lock()
+pool_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """Connect to the PostgreSQL database.  Returns a new database connection."""
+    return psycopg2.connect(DSN)
 
 
-def deleteMatches():
-    """Remove all the match records from the database."""
-    database = connect()
+def getPool():
+    """Returns the pool of connections shared by every function, opening it on first use."""
+    global pool
 
-    database.cursor().execute("delete from matches;")
+    with pool_lock:
+        if pool is None:
+            pool = ThreadedConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, DSN)
 
-    database.commit()
-    database.close()
+    return pool
 
 
-def deletePlayers():
-    """Remove all the player records from the database."""
-    database = connect()
+def closePool():
+    """Close every pooled connection, such as before exiting or forking."""
+    global pool
 
-    database.cursor().execute("delete from players;")
+    with pool_lock:
+        if pool is not None:
+            pool.closeall()
+            pool = None
 
-    database.commit()
-    database.close()
 
+@contextmanager
+def pooledConnection():
+    """Hands out a pooled connection for the duration of a with block.
 
-def countPlayers():
-    """Returns the number of players currently registered."""
-    database = connect()
+    The transaction is committed if the block finishes, and rolled back by the
+    pool when the connection is handed back otherwise. Waits for a connection to
+    be handed back if TOURNAMENT_POOL_MAX_SIZE are in use already.
+    """
+    connection_pool = getPool()
 
-    cursor = database.cursor()
-    cursor.execute("select count(*) from players;")
+    with pool_slots:
+        database = connection_pool.getconn()
 
-    # our table will have one row, so pull just that row
-    row = cursor.fetchone()
+        try:
+            yield database
+            database.commit()
+        finally:
+            connection_pool.putconn(database)
 
-    database.close()
+
+def createTournament(name):
+    """Adds a tournament to the database.
+
+    Every other function works on the players and matches of a single
+    tournament, given by the id this returns.
+
+    Args:
+      name: the tournament's name (need not be unique).
+
+    Returns:
+      The id assigned to the tournament.
+    """
+    with pooledConnection() as database:
+        cursor = database.cursor()
+        cursor.execute("insert into tournaments (name) values (%s) returning id;", (name,))
+
+        return cursor.fetchone()[0]
+
+
+def deleteTournament(tournament):
+    """Remove a tournament from the database, along with its players and matches."""
+    with pooledConnection() as database:
+        database.cursor().execute("delete from tournaments where id = %s;", (tournament,))
+
+
+def deleteMatches(tournament):
+    """Remove all the match records of a tournament, and reset its standings."""
+    with pooledConnection() as database:
+        cursor = database.cursor()
+        cursor.execute("delete from matches where tournament = %s;", (tournament,))
+        cursor.execute("update standings set wins = 0, matches = 0 where tournament = %s;",
+            (tournament,))
+
+
+def deletePlayers(tournament):
+    """Remove all the player records of a tournament, along with their standings."""
+    with pooledConnection() as database:
+        database.cursor().execute("delete from players where tournament = %s;", (tournament,))
+
+
+def countPlayers(tournament):
+    """Returns the number of players currently registered in a tournament."""
+    with pooledConnection() as database:
+        cursor = database.cursor()
+        cursor.execute("select count(*) from players where tournament = %s;", (tournament,))
+
+        # our table will have one row, so pull just that row
+        row = cursor.fetchone()
 
     # cast the count to an int and return
     return int(row[0])
 
 
-def registerPlayer(name):
-    """Adds a player to the tournament database.
+def registerPlayer(tournament, name):
+    """Adds a player to a tournament.
 
     The database assigns a unique serial id number for the player.  (This
     should be handled by your SQL database schema, not in your Python code.)
 
     Args:
+      tournament: the id of the tournament to register in.
       name: the player's full name (need not be unique).
     """
-    database = connect()
+    registerPlayers(tournament, [name])
+
+
+def registerPlayers(tournament, names):
+    """Adds many players to a tournament in a single transaction.
+
+    Args:
+      tournament: the id of the tournament to register in.
+      names: the players' full names.
+
+    Returns:
+      A list of the ids assigned to the players, in the same order as their names.
+    """
+    ids = list()
+
+    with pooledConnection() as database:
+        cursor = database.cursor()
 
-    database.cursor().execute("insert into players values (default, %s);", (name,))
+        # give every player an empty row in the standings along with their record. returning
+        # gives the rows in no particular order, but the serial numbers them in the order they
+        # are inserted, which is the order of the names
+        for rows in batches([(tournament, name) for name in names]):
+            cursor.execute("with inserted as (insert into players (tournament, name) values %s "
+                "returning tournament, id), standing as (insert into standings "
+                "(tournament, player) select tournament, id from inserted) "
+                "select id from inserted order by id;" % (valuesList(cursor, "(%s, %s)", rows),))
 
-    database.commit()
-    database.close()
+            ids.extend(row[0] for row in cursor.fetchall())
 
+    return ids
 
-def playerStandings():
-    """Returns a list of the players and their win records, sorted by wins.
+
+def playerStandings(tournament):
+    """Returns a list of the players of a tournament and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    Args:
+      tournament: the id of the tournament.
+
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
@@ -77,15 +190,15 @@ def playerStandings():
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    database = connect()
-
-    cursor = database.cursor()
-    cursor.execute("select * from standings;")
+    with pooledConnection() as database:
+        cursor = database.cursor()
+        cursor.execute("select players.id, players.name, standings.wins, standings.matches "
+            "from standings join players on players.id = standings.player "
+            "where standings.tournament = %s "
+            "order by standings.wins desc, standings.player;", (tournament,))
 
-    # we are retrieving potentially a number of rows, so fetch them all
-    rows = cursor.fetchall()
-
-    database.close()
+        # we are retrieving potentially a number of rows, so fetch them all
+        rows = cursor.fetchall()
 
     # the win and match counts are returned as longs
     # we cast them back to int to keep things clean
@@ -97,57 +210,124 @@ def playerStandings():
     return clean_rows
 
 
-def reportMatch(winner, loser):
+def reportMatch(tournament, winner, loser):
     """Records the outcome of a single match between two players.
 
     Args:
+      tournament:  the id of the tournament both players are registered in
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
     """
-    database = connect()
+    reportMatches(tournament, [(winner, loser)])
+
+
+def reportMatches(tournament, pairs):
+    """Records the outcomes of many matches in a single transaction.
+
+    Raises IntegrityError if any of the players is not registered in the
+    tournament, recording none of the matches.
+
+    Args:
+      tournament: the id of the tournament the players are registered in.
+      pairs: a list of (winner, loser) tuples of player ids, where loser may be
+        None for a player who had no opponent.
+    """
+    pairs = list(pairs)
 
-    query = "insert into matches values (default, %s, %s);"
-    cursor = database.cursor().execute(query, (winner, loser))
+    # sum up the wins and matches each player gains, a bye counting as a win
+    gains = dict()
 
-    database.commit()
-    database.close()
+    for winner, loser in pairs:
+        gains.setdefault(winner, [0, 0])
+        gains[winner][0] += 1
+        gains[winner][1] += 1
 
+        if loser is not None:
+            gains.setdefault(loser, [0, 0])
+            gains[loser][1] += 1
 
-def swissPairings():
-    """Returns a list of pairs of players for the next round of a match.
+    gains = [(player, wins, matches) for player, (wins, matches) in sorted(gains.items())]
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    with pooledConnection() as database:
+        cursor = database.cursor()
+
+        # lock the standings of every player in order of player before changing any. an update
+        # locks its rows in whatever order the join visits them, so concurrent reports sharing
+        # players could otherwise deadlock
+        cursor.execute("select player from standings where player = any(%s) "
+            "and tournament = %s order by player for update;",
+            ([row[0] for row in gains], tournament))
+
+        for rows in batches([(tournament, winner, loser) for winner, loser in pairs]):
+            cursor.execute("insert into matches (tournament, winner, loser) values %s;" % (
+                valuesList(cursor, "(%s, %s, %s)", rows),))
+
+        for rows in batches(gains):
+            cursor.execute("update standings set wins = standings.wins + gain.wins, "
+                "matches = standings.matches + gain.matches "
+                "from (values %s) as gain (player, wins, matches) "
+                "where standings.player = gain.player and standings.tournament = %%s;" % (
+                valuesList(cursor, "(%s, %s, %s)", rows),), (tournament,))
+
+
+def batches(rows):
+    """Splits a list of rows into lists of up to BATCH_SIZE rows."""
+    return [rows[i:i+BATCH_SIZE] for i in xrange(0, len(rows), BATCH_SIZE)]
+
+
+def valuesList(cursor, template, rows):
+    """Returns the rows as the list of a multi-row values clause, quoted by psycopg2."""
+    return ",".join(cursor.mogrify(template, row) for row in rows)
+
+
+def swissPairings(tournament):
+    """Returns a list of pairs of players for the next round of a tournament.
+
+    Each player is paired with another player with an equal or nearly-equal win
+    record who they have not played yet, see swiss.pairPlayers. If there are an
+    odd number of players, the lowest ranked player who has not had a bye yet is
+    paired with no one, and wins by default once reportMatch is called with no
+    loser.
+
+    Pairings without rematches are found by a bounded backtracking search around
+    the players the first pass leaves unpaired, not by a full matching, so once
+    most players have met, it can give up on pairings which do exist. The players
+    are then paired rematches and all, and every rematch is logged as a warning.
+
+    Args:
+      tournament: the id of the tournament.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, or None for a bye
+        name2: the second player's name, or None for a bye
     """
-    standings = playerStandings()
+    standings = playerStandings(tournament)
+
+    # load every past match of the tournament in one query, to know who has played who and who
+    # has had a bye
+    with pooledConnection() as database:
+        cursor = database.cursor()
+        cursor.execute("select winner, loser from matches where tournament = %s;", (tournament,))
 
-    # split into groups of two with a potential single remainder
-    pairs = [standings[i:i+2] for i in xrange(0, len(standings), 2)]
+        played = set()
+        byes = set()
 
-    swiss_pairings = list()
+        for winner, loser in cursor:
+            if loser is None:
+                byes.add(winner)
+            else:
+                played.add(pairKey(winner, loser))
 
-    for pair in pairs:
-        # save the first player's information
-        one_id = pair[0][0]
-        one_name = pair[0][1]
+    names = dict((row[0], row[1]) for row in standings)
+    pairs = pairPlayers([(row[0], row[2]) for row in standings], played, byes)
 
-        # if there is a second player, store her information, or set to None if no player exists
-        if len(pair) == 2:
-            two_id = pair[1][0]
-            two_name = pair[1][1]
-        else:
-            two_id = two_name = None
+    rematches = [pair for pair in pairs if pair[1] is not None and pairKey(*pair) in played]
 
-        # append the final pairing to the list of swiss pairings
-        swiss_pairings.append((one_id, one_name, two_id, two_name))
+    if rematches:
+        log.warning("tournament %s: pairing %d players who have met before: %s",
+            tournament, len(rematches) * 2, rematches)
 
-    return swiss_pairings
+    return [(one, names[one], two, names.get(two)) for one, two in pairs]
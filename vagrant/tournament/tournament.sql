@@ -7,34 +7,48 @@
 -- these lines here.
 
 
--- a simple player table
-create table players (
+-- every event gets its own tournament, so many can share the database
+create table tournaments (
     id serial primary key,
     name varchar(255) not null
 );
 
--- a player wins by default if he has no opponent, so loser can be null
+-- a simple player table, partitioned by tournament
+create table players (
+    id serial primary key,
+    tournament int references tournaments(id) on delete cascade not null,
+    name varchar(255) not null,
+    unique (tournament, id)
+);
+
+-- a player wins by default if he has no opponent, so loser can be null. both
+-- players must be registered in the tournament of the match
 create table matches (
     id serial primary key,
-    winner int references players(id) not null,
-    loser int references players(id)
+    tournament int references tournaments(id) on delete cascade not null,
+    winner int not null,
+    loser int,
+    foreign key (tournament, winner) references players(tournament, id),
+    foreign key (tournament, loser) references players(tournament, id)
 );
 
--- aggregate the number of matches each player has joined
-create view rounds as
-    select players.id, count(matches) as total from players
-    left join matches on matches.winner = players.id or matches.loser = players.id
-    group by players.id;
-
--- aggregate the number of wins each player has enjoyed
-create view wins as
-    select players.id, count(matches.winner) as total from players
-    left join matches on matches.winner = players.id
-    group by players.id;
-
--- aggregate the player standings, ordered by wins
-create view standings as
-    select players.id, players.name, wins.total as wins, rounds.total as matches from players
-    left join wins on wins.id = players.id
-    left join rounds on rounds.id = players.id
-    order by wins desc;
+-- the wins and matches of each player, kept up to date by tournament.py as
+-- matches are reported, so reading the standings never aggregates the matches
+create table standings (
+    player int primary key,
+    tournament int not null,
+    wins int not null default 0,
+    matches int not null default 0,
+    foreign key (tournament, player) references players(tournament, id) on delete cascade
+);
+
+-- look up the matches of a tournament without scanning the others. the players
+-- of a tournament are looked up by the index of unique (tournament, id)
+create index matches_tournament on matches (tournament);
+
+-- look up the matches of a player by either side
+create index matches_winner on matches (winner);
+create index matches_loser on matches (loser);
+
+-- read the standings of a tournament in order without sorting them
+create index standings_wins on standings (tournament, wins desc, player);
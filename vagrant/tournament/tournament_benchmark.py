@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+#
+# tournament_benchmark.py -- benchmarks for tournament.py
+#
+# The benchmarks run against the database given by TOURNAMENT_DSN (default dbname=tournament),
+# in tournaments of their own which they delete when done, but a throwaway database is best:
+#
+#     $ TOURNAMENT_DSN=dbname=tournament_benchmark python tournament_benchmark.py calls
+#
+
+import argparse
+import random
+import threading
+
+import swiss
+import tournament
+
+from timeit import default_timer as timer
+
+
+class ConnectPerCall(object):
+    """Stands in for the pool, opening a connection per call and closing it after.
+
+    This is how every function connected before the pool, so benchmarking with it
+    installed as tournament.pool measures the cost the pool saves.
+    """
+
+    def getconn(self):
+        return tournament.connect()
+
+    def putconn(self, database):
+        database.close()
+
+    def closeall(self):
+        pass
+
+
+def percentile(latencies, fraction):
+    """Return the latency below which the given fraction of the sorted latencies fall."""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def printRow(*columns):
+    """Print a row of a results table with fixed width columns."""
+    print ''.join(str(column).rjust(14) for column in columns)
+
+
+def benchmarkCalls(arguments):
+    """Measure the latency of calls to tournament.py, connecting per call and pooled."""
+    # the pool closes the connections handed back beyond its minimum, so with more threads than
+    # that some pooled calls connect as well
+    if arguments.threads > tournament.POOL_MIN_SIZE:
+        print 'Only %d of %d threads keep their pooled connections open' % (
+            tournament.POOL_MIN_SIZE, arguments.threads)
+
+    printRow('mode', 'calls', 'calls/s', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')
+
+    for mode in ('connect', 'pooled'):
+        tournament.closePool()
+
+        if mode == 'connect':
+            tournament.pool = ConnectPerCall()
+
+        event = tournament.createTournament("Benchmark")
+
+        for i in xrange(arguments.players):
+            tournament.registerPlayer(event, "Player %d" % i)
+
+        ids = [row[0] for row in tournament.playerStandings(event)]
+        latencies = []
+        lock = threading.Lock()
+
+        # a mix of the calls made while running a tournament, mostly reporting matches
+        calls = [
+            lambda: tournament.reportMatch(event, *random.sample(ids, 2)),
+            lambda: tournament.reportMatch(event, *random.sample(ids, 2)),
+            lambda: tournament.registerPlayer(event, "Late Player"),
+            lambda: tournament.countPlayers(event),
+            lambda: tournament.playerStandings(event)
+        ]
+
+        def run(count):
+            for i in xrange(count):
+                call = random.choice(calls)
+                start = timer()
+                call()
+                elapsed = timer() - start
+
+                with lock:
+                    latencies.append(elapsed)
+
+        threads = [threading.Thread(target=run, args=(arguments.calls // arguments.threads,))
+            for i in xrange(arguments.threads)]
+        start = timer()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        duration = timer() - start
+        latencies.sort()
+
+        printRow(mode, len(latencies), '%.0f' % (len(latencies) / duration),
+            '%.2f' % (sum(latencies) / len(latencies) * 1e3),
+            '%.2f' % (percentile(latencies, 0.5) * 1e3),
+            '%.2f' % (percentile(latencies, 0.95) * 1e3),
+            '%.2f' % (percentile(latencies, 0.99) * 1e3))
+
+        tournament.deleteTournament(event)
+
+    tournament.closePool()
+
+
+def benchmarkLoad(arguments):
+    """Measure how long registering players and reporting a round takes, one by one and in bulk."""
+    printRow('mode', 'players', 'register s', 'report s')
+
+    for mode in ('single', 'bulk'):
+        event = tournament.createTournament("Benchmark")
+        names = ["Player %d" % i for i in xrange(arguments.players)]
+        start = timer()
+
+        if mode == 'single':
+            for name in names:
+                tournament.registerPlayer(event, name)
+
+            ids = [row[0] for row in tournament.playerStandings(event)]
+        else:
+            ids = tournament.registerPlayers(event, names)
+
+        register = timer() - start
+
+        # pair the players off into a round, giving the odd one out a bye
+        pairs = [(ids[i], ids[i + 1] if i + 1 < len(ids) else None)
+            for i in xrange(0, len(ids), 2)]
+        start = timer()
+
+        if mode == 'single':
+            for winner, loser in pairs:
+                tournament.reportMatch(event, winner, loser)
+        else:
+            tournament.reportMatches(event, pairs)
+
+        printRow(mode, len(ids), '%.2f' % register, '%.2f' % (timer() - start))
+        tournament.deleteTournament(event)
+
+    tournament.closePool()
+
+
+def benchmarkStandings(arguments):
+    """Measure the latency of reading the standings as rounds of matches are reported."""
+    printRow('rounds', 'matches', 'standings ms')
+
+    event = tournament.createTournament("Benchmark")
+    ids = tournament.registerPlayers(event, ["Player %d" % i for i in xrange(arguments.players)])
+
+    for round in xrange(arguments.rounds + 1):
+        if round:
+            random.shuffle(ids)
+            tournament.reportMatches(event, zip(ids[0::2], ids[1::2]))
+
+        start = timer()
+
+        for i in xrange(arguments.reads):
+            tournament.playerStandings(event)
+
+        printRow(round, round * (len(ids) // 2),
+            '%.2f' % ((timer() - start) / arguments.reads * 1e3))
+
+    tournament.deleteTournament(event)
+    tournament.closePool()
+
+
+def benchmarkTournaments(arguments):
+    """Measure the latency of running a tournament as more and more run alongside it."""
+    printRow('tournaments', 'rounds/s', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')
+
+    for count in arguments.tournaments:
+        latencies = []
+        lock = threading.Lock()
+
+        def run():
+            # play out a whole tournament, timing each round of pairing, reporting and standings
+            event = tournament.createTournament("Benchmark")
+            tournament.registerPlayers(event, ["Player %d" % i for i in xrange(arguments.players)])
+
+            for round in xrange(arguments.rounds):
+                start = timer()
+                pairs = tournament.swissPairings(event)
+                tournament.reportMatches(event, [(pair[0], pair[2]) for pair in pairs])
+                tournament.playerStandings(event)
+                elapsed = timer() - start
+
+                with lock:
+                    latencies.append(elapsed)
+
+            tournament.deleteTournament(event)
+
+        threads = [threading.Thread(target=run) for i in xrange(count)]
+        start = timer()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        duration = timer() - start
+        latencies.sort()
+
+        printRow(count, '%.0f' % (len(latencies) / duration),
+            '%.2f' % (sum(latencies) / len(latencies) * 1e3),
+            '%.2f' % (percentile(latencies, 0.5) * 1e3),
+            '%.2f' % (percentile(latencies, 0.95) * 1e3),
+            '%.2f' % (percentile(latencies, 0.99) * 1e3))
+
+    tournament.closePool()
+
+
+def benchmarkPairing(arguments):
+    """Measure how long pairing a round takes as a large tournament is played out in memory."""
+    printRow('round', 'players', 'pairing s', 'rematches')
+
+    random.seed(arguments.seed)
+
+    wins = dict((player, 0) for player in xrange(arguments.players))
+    played = set()
+    byes = set()
+
+    for round in xrange(1, arguments.rounds + 1):
+        start = timer()
+        pairs = swiss.pairPlayers(wins.items(), played, byes)
+        duration = timer() - start
+        rematches = 0
+
+        # play the round out, picking every winner at random
+        for one, two in pairs:
+            if two is None:
+                byes.add(one)
+                wins[one] += 1
+            else:
+                rematches += swiss.pairKey(one, two) in played
+                played.add(swiss.pairKey(one, two))
+                wins[random.choice((one, two))] += 1
+
+        printRow(round, arguments.players, '%.3f' % duration, rematches)
+
+
+def benchmarkSwissPairings(arguments):
+    """Measure how long swissPairings takes as a large tournament is played out in the database."""
+    printRow('round', 'players', 'pairing s', 'report s', 'rematches')
+
+    random.seed(arguments.seed)
+
+    event = tournament.createTournament("Benchmark")
+    tournament.registerPlayers(event, ["Player %d" % i for i in xrange(arguments.players)])
+    played = set()
+
+    for round in xrange(1, arguments.rounds + 1):
+        start = timer()
+        pairs = [(pair[0], pair[2]) for pair in tournament.swissPairings(event)]
+        pairing = timer() - start
+        rematches = 0
+
+        # count the rematches, then report the round, picking every winner at random
+        for one, two in pairs:
+            if two is not None:
+                rematches += swiss.pairKey(one, two) in played
+                played.add(swiss.pairKey(one, two))
+
+        start = timer()
+        tournament.reportMatches(event, [pair if pair[1] is None or random.random() < 0.5
+            else (pair[1], pair[0]) for pair in pairs])
+
+        printRow(round, arguments.players, '%.3f' % pairing, '%.3f' % (timer() - start),
+            rematches)
+
+    tournament.deleteTournament(event)
+    tournament.closePool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark tournament.py.')
+    benchmarks = parser.add_subparsers()
+
+    calls = benchmarks.add_parser('calls', help=benchmarkCalls.__doc__)
+    calls.add_argument('--calls', type=int, default=5000, help='the number of calls to time')
+    calls.add_argument('--players', type=int, default=100,
+        help='the number of players to register first')
+    calls.add_argument('--threads', type=int, default=4,
+        help='the number of threads making calls at once')
+    calls.set_defaults(benchmark=benchmarkCalls)
+
+    load = benchmarks.add_parser('load', help=benchmarkLoad.__doc__)
+    load.add_argument('--players', type=int, default=10000,
+        help='the number of players to register and pair off')
+    load.set_defaults(benchmark=benchmarkLoad)
+
+    standings = benchmarks.add_parser('standings', help=benchmarkStandings.__doc__)
+    standings.add_argument('--players', type=int, default=1000,
+        help='the number of players to register')
+    standings.add_argument('--rounds', type=int, default=20,
+        help='the number of rounds of matches to report')
+    standings.add_argument('--reads', type=int, default=20,
+        help='the number of times the standings are read after each round')
+    standings.set_defaults(benchmark=benchmarkStandings)
+
+    tournaments = benchmarks.add_parser('tournaments', help=benchmarkTournaments.__doc__)
+    tournaments.add_argument('--tournaments', type=int, nargs='+', default=[1, 10, 100],
+        help='the numbers of tournaments to run at once, each on a thread of its own')
+    tournaments.add_argument('--players', type=int, default=64,
+        help='the number of players in each tournament')
+    tournaments.add_argument('--rounds', type=int, default=6,
+        help='the number of rounds to play in each tournament')
+    tournaments.set_defaults(benchmark=benchmarkTournaments)
+
+    pairing = benchmarks.add_parser('pairing', help=benchmarkPairing.__doc__)
+    pairing.add_argument('--players', type=int, default=100001,
+        help='the number of players to pair')
+    pairing.add_argument('--rounds', type=int, default=17,
+        help='the number of rounds to play out')
+    pairing.add_argument('--seed', type=int, default=0, help='the seed of the random results')
+    pairing.set_defaults(benchmark=benchmarkPairing)
+
+    swiss_pairings = benchmarks.add_parser('swiss', help=benchmarkSwissPairings.__doc__)
+    swiss_pairings.add_argument('--players', type=int, default=100001,
+        help='the number of players to register and pair')
+    swiss_pairings.add_argument('--rounds', type=int, default=17,
+        help='the number of rounds to play out')
+    swiss_pairings.add_argument('--seed', type=int, default=0,
+        help='the seed of the random results')
+    swiss_pairings.set_defaults(benchmark=benchmarkSwissPairings)
+
+    arguments = parser.parse_args()
+    arguments.benchmark(arguments)
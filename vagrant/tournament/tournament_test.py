@@ -8,50 +8,55 @@
 
 from tournament import *
 
+# the tests run in a tournament of their own, which is deleted once they pass
+tournament = createTournament("Test Tournament")
+
+
 def testCount():
     """
     Test for initial player count,
              player count after 1 and 2 players registered,
              player count after players deleted.
     """
-    deleteMatches()
-    deletePlayers()
-    c = countPlayers()
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    c = countPlayers(tournament)
     if c == '0':
         raise TypeError(
             "countPlayers should return numeric zero, not string '0'.")
     if c != 0:
         raise ValueError("After deletion, countPlayers should return zero.")
     print "1. countPlayers() returns 0 after initial deletePlayers() execution."
-    registerPlayer("Chandra Nalaar")
-    c = countPlayers()
+    registerPlayer(tournament, "Chandra Nalaar")
+    c = countPlayers(tournament)
     if c != 1:
         raise ValueError(
             "After one player registers, countPlayers() should be 1. Got {c}".format(c=c))
     print "2. countPlayers() returns 1 after one player is registered."
-    registerPlayer("Jace Beleren")
-    c = countPlayers()
+    registerPlayer(tournament, "Jace Beleren")
+    c = countPlayers(tournament)
     if c != 2:
         raise ValueError(
             "After two players register, countPlayers() should be 2. Got {c}".format(c=c))
     print "3. countPlayers() returns 2 after two players are registered."
-    deletePlayers()
-    c = countPlayers()
+    deletePlayers(tournament)
+    c = countPlayers(tournament)
     if c != 0:
         raise ValueError(
             "After deletion, countPlayers should return zero.")
     print "4. countPlayers() returns zero after registered players are deleted.\n5. Player records successfully deleted."
 
+
 def testStandingsBeforeMatches():
     """
     Test to ensure players are properly represented in standings prior
     to any matches being reported.
     """
-    deleteMatches()
-    deletePlayers()
-    registerPlayer("Melpomene Murray")
-    registerPlayer("Randy Schwartz")
-    standings = playerStandings()
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    registerPlayer(tournament, "Melpomene Murray")
+    registerPlayer(tournament, "Randy Schwartz")
+    standings = playerStandings(tournament)
     if len(standings) < 2:
         raise ValueError("Players should appear in playerStandings even before "
                          "they have played any matches.")
@@ -68,22 +73,23 @@ def testStandingsBeforeMatches():
                          "even if they have no matches played.")
     print "6. Newly registered players appear in the standings with no matches."
 
+
 def testReportMatches():
     """
     Test that matches are reported properly.
     Test to confirm matches are deleted properly.
     """
-    deleteMatches()
-    deletePlayers()
-    registerPlayer("Bruno Walton")
-    registerPlayer("Boots O'Neal")
-    registerPlayer("Cathy Burton")
-    registerPlayer("Diane Grant")
-    standings = playerStandings()
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    registerPlayer(tournament, "Bruno Walton")
+    registerPlayer(tournament, "Boots O'Neal")
+    registerPlayer(tournament, "Cathy Burton")
+    registerPlayer(tournament, "Diane Grant")
+    standings = playerStandings(tournament)
     [id1, id2, id3, id4] = [row[0] for row in standings]
-    reportMatch(id1, id2)
-    reportMatch(id3, id4)
-    standings = playerStandings()
+    reportMatch(tournament, id1, id2)
+    reportMatch(tournament, id3, id4)
+    standings = playerStandings(tournament)
     for (i, n, w, m) in standings:
         if m != 1:
             raise ValueError("Each player should have one match recorded.")
@@ -92,8 +98,8 @@ def testReportMatches():
         elif i in (id2, id4) and w != 0:
             raise ValueError("Each match loser should have zero wins recorded.")
     print "7. After a match, players have updated standings."
-    deleteMatches()
-    standings = playerStandings()
+    deleteMatches(tournament)
+    standings = playerStandings(tournament)
     if len(standings) != 4:
         raise ValueError("Match deletion should not change number of players in standings.")
     for (i, n, w, m) in standings:
@@ -103,31 +109,32 @@ def testReportMatches():
             raise ValueError("After deleting matches, players should have zero wins recorded.")
     print "8. After match deletion, player standings are properly reset.\n9. Matches are properly deleted."
 
+
 def testPairings():
     """
     Test that pairings are generated properly both before and after match reporting.
     """
-    deleteMatches()
-    deletePlayers()
-    registerPlayer("Twilight Sparkle")
-    registerPlayer("Fluttershy")
-    registerPlayer("Applejack")
-    registerPlayer("Pinkie Pie")
-    registerPlayer("Rarity")
-    registerPlayer("Rainbow Dash")
-    registerPlayer("Princess Celestia")
-    registerPlayer("Princess Luna")
-    standings = playerStandings()
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    registerPlayer(tournament, "Twilight Sparkle")
+    registerPlayer(tournament, "Fluttershy")
+    registerPlayer(tournament, "Applejack")
+    registerPlayer(tournament, "Pinkie Pie")
+    registerPlayer(tournament, "Rarity")
+    registerPlayer(tournament, "Rainbow Dash")
+    registerPlayer(tournament, "Princess Celestia")
+    registerPlayer(tournament, "Princess Luna")
+    standings = playerStandings(tournament)
     [id1, id2, id3, id4, id5, id6, id7, id8] = [row[0] for row in standings]
-    pairings = swissPairings()
+    pairings = swissPairings(tournament)
     if len(pairings) != 4:
         raise ValueError(
             "For eight players, swissPairings should return 4 pairs. Got {pairs}".format(pairs=len(pairings)))
-    reportMatch(id1, id2)
-    reportMatch(id3, id4)
-    reportMatch(id5, id6)
-    reportMatch(id7, id8)
-    pairings = swissPairings()
+    reportMatch(tournament, id1, id2)
+    reportMatch(tournament, id3, id4)
+    reportMatch(tournament, id5, id6)
+    reportMatch(tournament, id7, id8)
+    pairings = swissPairings(tournament)
     if len(pairings) != 4:
         raise ValueError(
             "For eight players, swissPairings should return 4 pairs. Got {pairs}".format(pairs=len(pairings)))
@@ -147,9 +154,64 @@ def testPairings():
     print "10. After one match, players with one win are properly paired."
 
 
+def testBulkFunctions():
+    """
+    Test that players registered and matches reported in bulk are recorded like single ones.
+    """
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    names = ["Player %d" % i for i in xrange(2501)]
+    ids = registerPlayers(tournament, names)
+    if len(set(ids)) != 2501 or countPlayers(tournament) != 2501:
+        raise ValueError("registerPlayers should register every player once.")
+    if dict((i, n) for (i, n, w, m) in playerStandings(tournament)) != dict(zip(ids, names)):
+        raise ValueError("registerPlayers should return the ids in the order of the names.")
+    print "11. registerPlayers() registers every player and returns their ids in order."
+    reportMatches(tournament, [(ids[i], ids[i + 1]) for i in xrange(0, 2500, 2)] + [(ids[2500], None)])
+    winners = set(ids[0::2])
+    for (i, n, w, m) in playerStandings(tournament):
+        if m != 1 or w != (1 if i in winners else 0):
+            raise ValueError("reportMatches should record every match once.")
+    print "12. reportMatches() records every match, including byes."
+
+
+def testTournaments():
+    """
+    Test that tournaments keep their players, matches and standings apart.
+    """
+    deleteMatches(tournament)
+    deletePlayers(tournament)
+    other = createTournament("Other Tournament")
+    try:
+        [id1, id2] = registerPlayers(tournament, ["Ajani Goldmane", "Liliana Vess"])
+        [id3, id4] = registerPlayers(other, ["Nissa Revane", "Gideon Jura"])
+        reportMatch(tournament, id1, id2)
+        if countPlayers(tournament) != 2 or countPlayers(other) != 2:
+            raise ValueError("Each tournament should only count its own players.")
+        if [row[0] for row in playerStandings(other)] != [id3, id4] or (
+                playerStandings(other)[0][3] != 0):
+            raise ValueError("Matches should only count in the standings of their tournament.")
+        try:
+            reportMatch(other, id3, id1)
+        except psycopg2.IntegrityError:
+            pass
+        else:
+            raise ValueError("Matches should only be reported between players of the tournament.")
+        deleteMatches(other)
+        deletePlayers(other)
+        if countPlayers(tournament) != 2 or playerStandings(tournament)[0][2] != 1:
+            raise ValueError("Deleting a tournament's records should leave the others alone.")
+    finally:
+        deleteTournament(other)
+    print "13. Tournaments keep their players, matches and standings apart."
+
+
 if __name__ == '__main__':
     testCount()
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testBulkFunctions()
+    testTournaments()
+    deleteTournament(tournament)
     print "Success!  All tests pass!"